@@ -9,7 +9,12 @@ import litellm
 import uuid
 import time
 import sys
+import asyncio
+import inspect
 from agent.configs import settings
+from agent.metrics import metrics
+from agent.json_stream import IncrementalJSONScanner
+from agent.oai_streaming import StreamDeadlines, StreamStalled, watch_stream, record_stall
 
 # Configure logging
 logging.basicConfig(
@@ -867,6 +872,24 @@ def convert_litellm_to_anthropic(litellm_response: Union[Dict[str, Any], Any],
             usage=Usage(input_tokens=0, output_tokens=0)
         )
 
+def tool_input_repair_events(tool_scanners: Dict[int, IncrementalJSONScanner]) -> List[str]:
+    """Deltas completing tool inputs that the upstream left truncated."""
+    events = []
+
+    for index, scanner in tool_scanners.items():
+        if not scanner.started or scanner.complete:
+            continue
+
+        suffix = scanner.closing_suffix()
+
+        if suffix:
+            logger.warning(f"Completing truncated tool input of block {index} with {suffix!r}")
+            events.append(f"event: content_block_delta\ndata: {json.dumps({'type': 'content_block_delta', 'index': index, 'delta': {'type': 'input_json_delta', 'partial_json': suffix}})}\n\n")
+        else:
+            logger.warning(f"Tool input of block {index} is malformed and cannot be completed")
+
+    return events
+
 async def handle_streaming(response_generator, original_request: MessagesRequest):
     """Handle streaming responses from LiteLLM and convert to Anthropic format."""
     try:
@@ -909,6 +932,7 @@ async def handle_streaming(response_generator, original_request: MessagesRequest
         output_tokens = 0
         has_sent_stop_reason = False
         last_tool_index = 0
+        tool_scanners: Dict[int, IncrementalJSONScanner] = {}
         
         # Process each chunk
         async for chunk in response_generator:
@@ -1020,6 +1044,7 @@ async def handle_streaming(response_generator, original_request: MessagesRequest
                                 yield f"event: content_block_start\ndata: {json.dumps({'type': 'content_block_start', 'index': anthropic_tool_index, 'content_block': {'type': 'tool_use', 'id': tool_id, 'name': name, 'input': {}}})}\n\n"
                                 current_tool_call = tool_call
                                 tool_content = ""
+                                tool_scanners[anthropic_tool_index] = IncrementalJSONScanner()
                             
                             # Extract function arguments
                             arguments = None
@@ -1032,19 +1057,13 @@ async def handle_streaming(response_generator, original_request: MessagesRequest
                             
                             # If we have arguments, send them as a delta
                             if arguments:
-                                # Try to detect if arguments are valid JSON or just a fragment
-                                try:
-                                    # If it's already a dict, use it
-                                    if isinstance(arguments, dict):
-                                        args_json = json.dumps(arguments)
-                                    else:
-                                        # Otherwise, try to parse it
-                                        json.loads(arguments)
-                                        args_json = arguments
-                                except (json.JSONDecodeError, TypeError):
-                                    # If it's a fragment, treat it as a string
-                                    args_json = arguments
-                                
+                                # If it's already a dict, serialize it; fragments are passed through
+                                args_json = json.dumps(arguments) if isinstance(arguments, dict) else arguments
+
+                                # Track the JSON structure incrementally instead of re-parsing
+                                if isinstance(args_json, str):
+                                    tool_scanners[anthropic_tool_index].feed(args_json)
+
                                 # Add to accumulated tool content
                                 tool_content += args_json if isinstance(args_json, str) else ""
                                 
@@ -1057,6 +1076,9 @@ async def handle_streaming(response_generator, original_request: MessagesRequest
                         
                         # Close any open tool call blocks
                         if tool_index is not None:
+                            for event in tool_input_repair_events(tool_scanners):
+                                yield event
+
                             for i in range(1, last_tool_index + 1):
                                 yield f"event: content_block_stop\ndata: {json.dumps({'type': 'content_block_stop', 'index': i})}\n\n"
                         
@@ -1097,6 +1119,9 @@ async def handle_streaming(response_generator, original_request: MessagesRequest
         if not has_sent_stop_reason:
             # Close any open tool call blocks
             if tool_index is not None:
+                for event in tool_input_repair_events(tool_scanners):
+                    yield event
+
                 for i in range(1, last_tool_index + 1):
                     yield f"event: content_block_stop\ndata: {json.dumps({'type': 'content_block_stop', 'index': i})}\n\n"
             
@@ -1129,6 +1154,120 @@ async def handle_streaming(response_generator, original_request: MessagesRequest
         # Send final [DONE] marker
         yield "data: [DONE]\n\n"
 
+async def close_upstream(response_generator) -> None:
+    """Close the LiteLLM stream and the provider connection behind it."""
+    for target in (getattr(response_generator, 'completion_stream', None), response_generator):
+        for attr in ('aclose', 'close'):
+            close = getattr(target, attr, None)
+
+            if not callable(close):
+                continue
+
+            try:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.debug(f"Failed to close upstream stream: {e}")
+
+            break
+
+async def handle_streaming_until_disconnect(response_generator, original_request: MessagesRequest, raw_request: Request, reopen=None):
+    """
+    Wrap handle_streaming so a client abort (e.g. ESC in Claude Code) stops the
+    upstream generation instead of letting it run to completion.
+
+    The upstream is also watched for stalls; a stream that stalls before its
+    first chunk is re-opened through `reopen`, a later stall aborts it.
+    """
+    deadlines = StreamDeadlines.for_route("messages")
+    consumer = asyncio.current_task()
+    aborted = asyncio.Event()
+    aborted_at = 0.0
+    streamed_chunks = 0
+    completed = False
+    stalled = False
+
+    async def watch_disconnect():
+        nonlocal aborted_at
+
+        while not await raw_request.is_disconnected():
+            await asyncio.sleep(settings.disconnect_poll_seconds)
+
+        aborted_at = time.time()
+        aborted.set()
+        consumer.cancel()
+
+    async def count_chunks():
+        nonlocal streamed_chunks, stalled, response_generator
+        attempt = 0
+
+        while True:
+            try:
+                async for chunk in watch_stream(response_generator, deadlines):
+                    streamed_chunks += 1
+                    yield chunk
+
+                return
+
+            except StreamStalled as e:
+                attempt += 1
+
+                if streamed_chunks or reopen is None or attempt > settings.upstream_max_retries:
+                    # handle_streaming turns this into error events and ends normally
+                    stalled = True
+                    raise
+
+                logger.warning(f"{e}, reopening upstream stream (attempt {attempt})")
+                await close_upstream(response_generator)
+                response_generator = await reopen()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    chunks = count_chunks()
+
+    try:
+        async for event in handle_streaming(chunks, original_request):
+            yield event
+
+        completed = True
+
+    except asyncio.CancelledError:
+        if not aborted.is_set():
+            raise
+
+        consumer.uncancel()
+
+    except GeneratorExit:
+        # the response was closed before the stream ended: the client went away
+        aborted_at = time.time()
+        aborted.set()
+        raise
+
+    finally:
+        watcher.cancel()
+
+        try:
+            await chunks.aclose()
+        except Exception as e:
+            logger.debug(f"Failed to close chunk generator: {e}")
+
+        if not completed or stalled:
+            if stalled:
+                logger.warning(f"Upstream stream stalled after {streamed_chunks} chunks, closing it")
+
+            try:
+                await asyncio.wait_for(close_upstream(response_generator), timeout=settings.cancel_grace_seconds)
+            except asyncio.TimeoutError:
+                logger.warning("Timed out closing upstream stream")
+
+            if aborted.is_set():
+                # how much was generated, and how fast generation stopped after the abort
+                close_seconds = time.time() - aborted_at
+                metrics.inc("anthropic_streams_aborted")
+                metrics.observe("anthropic_aborted_stream_chunks", streamed_chunks)
+                metrics.observe("anthropic_abort_to_upstream_close_seconds", close_seconds)
+                logger.info(f"Client aborted stream after {streamed_chunks} chunks, upstream closed {close_seconds:.2f}s later")
+
 @app.post("/v1/messages")
 async def create_message(
     request: MessagesRequest,
@@ -1326,13 +1465,24 @@ async def create_message(
                 200  # Assuming success at this point
             )
             # Ensure we use the async version for streaming
-            response_generator = await litellm.acompletion(
-                **litellm_request,
-                base_url=settings.llm_base_url
-            )
+            deadlines = StreamDeadlines.for_route("messages")
+
+            async def open_stream():
+                try:
+                    return await litellm.acompletion(
+                        **litellm_request,
+                        base_url=settings.llm_base_url,
+                        timeout=deadlines.httpx_timeout()
+                    )
+                except litellm.Timeout:
+                    # the stream could not be opened in time
+                    record_stall(deadlines.route, "connect")
+                    raise
+
+            response_generator = await open_stream()
             
             return StreamingResponse(
-                handle_streaming(response_generator, request),
+                handle_streaming_until_disconnect(response_generator, request, raw_request, reopen=open_stream),
                 media_type="text/event-stream"
             )
         else:
@@ -1,24 +1,38 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from .xterm_toolcalls import mcp as xterm_mcp
 from .utils import (
     refine_chat_history,
+    refine_message,
     refine_assistant_message,
     refine_mcp_response,
+    inject_current_time,
+    messages_digest,
     execute_openai_compatible_toolcall,
     convert_mcp_tools_to_openai_format,
 )
 from .oai_streaming import (
-    create_streaming_response,
+    create_resumable_streaming_response,
     ChatCompletionResponseBuilder
 )
 from .oai_models import (
     ChatCompletionRequest, 
     ChatCompletionResponse,
     ChatCompletionStreamResponse,
+    ErrorResponse,
+    UsageInfo,
+    PromptTokenUsageInfo,
     random_uuid
 )
+from .sessions import session_store, ChatSession
+from .terminal import terminal_pool, interrupt_terminal
+from .jobs import job_manager
+from .metrics import metrics
+from .output_compression import compress_tool_result
 from typing import AsyncGenerator, Any
+from contextlib import nullcontext, aclosing
+from dataclasses import dataclass
+import asyncio
 import logging
 import time
 import json
@@ -39,12 +53,135 @@ async def get_system_prompt() -> str:
 
     return system_prompt
 
-async def handle_request(request: ChatCompletionRequest) -> AsyncGenerator[ChatCompletionStreamResponse | ChatCompletionResponse, None]:
+@dataclass
+class RequestStats:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    n_iterations: int = 0
+    prefill_seconds: float = 0.0
+    generation_seconds: float = 0.0
+    tool_seconds: float = 0.0
+    tool_chars_saved: int = 0
+
+    def add_usage(self, usage: UsageInfo | None) -> None:
+        if usage is None:
+            return
+
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+
+        if usage.prompt_tokens_details is not None:
+            self.cached_tokens += usage.prompt_tokens_details.cached_tokens or 0
+
+    @property
+    def cached_token_rate(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens > 0 else 0.0
+
+    @property
+    def generation_tps(self) -> float:
+        return self.completion_tokens / self.generation_seconds if self.generation_seconds > 0 else 0.0
+
+    def to_usage(self) -> UsageInfo:
+        return UsageInfo(
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            total_tokens=self.prompt_tokens + self.completion_tokens,
+            prompt_tokens_details=PromptTokenUsageInfo(cached_tokens=self.cached_tokens)
+        )
+
+    def report(self, req_id: str) -> None:
+        metrics.inc("prompt_tokens", self.prompt_tokens)
+        metrics.inc("completion_tokens", self.completion_tokens)
+        metrics.inc("cached_prompt_tokens", self.cached_tokens)
+
+        if self.prompt_tokens > 0:
+            metrics.observe("prompt_cached_token_rate", self.cached_token_rate)
+        metrics.observe("prompt_prefill_seconds", self.prefill_seconds)
+        metrics.observe("prompt_generation_seconds", self.generation_seconds)
+        metrics.observe("prompt_tool_seconds", self.tool_seconds)
+        metrics.observe("prompt_generation_tps", self.generation_tps)
+        metrics.inc("tool_output_chars_saved", self.tool_chars_saved)
+        metrics.inc("tool_output_tokens_saved", self.tool_chars_saved // 4)
+
+        logger.info(
+            f"Request {req_id} - Iterations: {self.n_iterations}, "
+            f"Tokens: {self.prompt_tokens} prompt ({self.cached_tokens} cached, {self.cached_token_rate:.0%}) / {self.completion_tokens} completion, "
+            f"Prefill: {self.prefill_seconds:.2f}s, Generation: {self.generation_seconds:.2f}s ({self.generation_tps:.2f} tokens/s), "
+            f"Tools: {self.tool_seconds:.2f}s ({self.tool_chars_saved} output characters compressed away)"
+        )
+
+async def cancel_on_disconnect(raw_request: Request, cancelled: asyncio.Event, task: asyncio.Task) -> None:
+    while not await raw_request.is_disconnected():
+        await asyncio.sleep(settings.disconnect_poll_seconds)
+
+    logger.info("Client disconnected, cancelling request")
+    metrics.inc("prompt_client_disconnects")
+    cancelled.set()
+    task.cancel()
+
+def check_prompt_prefix(messages: list[dict[str, Any]], previous: tuple[int, str] | None) -> tuple[int, str]:
+    """
+    Verifies that the previously sent prompt is a byte-identical prefix of
+    this one, which is what upstream prefix caches need to hit.
+    """
+    digest = messages_digest(messages)
+
+    if previous is not None:
+        n, previous_digest = previous
+        stable = n <= len(messages) and messages_digest(messages[:n]) == previous_digest
+        metrics.inc("prompt_prefix_stable" if stable else "prompt_prefix_changed")
+
+        if not stable:
+            logger.warning(f"Prompt prefix changed: the first {n} messages differ from the previous prompt ({previous_digest[:12]})")
+
+    logger.info(f"Prompt of {len(messages)} messages, digest {digest[:12]}")
+    return len(messages), digest
+
+async def handle_request(request: ChatCompletionRequest, stats: RequestStats) -> AsyncGenerator[dict[str, Any] | ChatCompletionResponse, None]:
+    session = session_store.get_or_create(request.session_id) if request.session_id else None
+
+    async with (session.lock if session is not None else nullcontext()):
+        async with terminal_pool.lease(owner=request.session_id) as terminal:
+            try:
+                async with aclosing(_handle_request(request, session, stats)) as gen:
+                    async for chunk in gen:
+                        yield chunk
+
+            except asyncio.CancelledError:
+                # stop whatever the cancelled tool call left running
+                await interrupt_terminal(terminal, timeout=settings.cancel_grace_seconds)
+                raise
+
+            finally:
+                # nobody can come back for an anonymous request's jobs
+                if request.session_id is None:
+                    job_manager.release(terminal.owner_key)
+
+async def _handle_request(request: ChatCompletionRequest, session: ChatSession | None, stats: RequestStats) -> AsyncGenerator[dict[str, Any] | ChatCompletionResponse, None]:
     messages = request.messages
     assert len(messages) > 0, "No messages in the request"
- 
-    system_prompt = await get_system_prompt()
-    messages: list[dict[str, Any]] = refine_chat_history(messages, system_prompt)
+    n_stored = 0
+
+    if session is not None and session.messages:
+        # the stored history is already refined, only the new turn needs it
+        logger.info(f"Resuming session {session.session_id} with {len(session.messages)} stored messages")
+        n_stored = len(session.messages)
+        # off the event loop, file parts are decoded and written to disk
+        messages: list[dict[str, Any]] = session.messages + await asyncio.to_thread(
+            lambda: [
+                refine_message(message)
+                for message in messages
+                if message.get('role', 'undefined') != 'system'
+            ]
+        )
+
+    else:
+        system_prompt = await get_system_prompt()
+        messages: list[dict[str, Any]] = await asyncio.to_thread(refine_chat_history, messages, system_prompt)
+
+    messages = inject_current_time(messages, start=n_stored)
+    sent_digest = session.prompt_digest if session is not None else None
 
     tools = await xterm_mcp.list_tools()
     oai_tools = convert_mcp_tools_to_openai_format(tools)
@@ -60,7 +197,8 @@ async def handle_request(request: ChatCompletionRequest) -> AsyncGenerator[ChatC
             messages=messages,
             tools=oai_tools,
             tool_choice="auto",
-            model=settings.llm_model_id
+            model=settings.llm_model_id,
+            stream_options={"include_usage": True}
         )
 
         if not use_tool_calls():
@@ -68,17 +206,41 @@ async def handle_request(request: ChatCompletionRequest) -> AsyncGenerator[ChatC
             payload.pop("tool_choice")
         
         logger.info(f"Payload - URL: {settings.llm_base_url}, API Key: {'*' * len(settings.llm_api_key)}, Model: {settings.llm_model_id}")
-        streaming_iter = create_streaming_response(
+        streaming_iter = create_resumable_streaming_response(
             settings.llm_base_url,
             settings.llm_api_key,
             **payload
         )
 
-        async for chunk in streaming_iter:
-            completion_builder.add_chunk(chunk)
+        sent_digest = check_prompt_prefix(messages, sent_digest)
+        sent_at = time.time()
+        first_chunk_at = last_chunk_at = None
+
+        # closing the generator closes the upstream connection, even on cancellation
+        async with aclosing(streaming_iter):
+            async for chunk in streaming_iter:
+                if isinstance(chunk, ErrorResponse):
+                    raise RuntimeError(f"Upstream error: {chunk.message}")
+
+                completion_builder.add_chunk(chunk)
+
+                if not chunk.get("choices"):
+                    continue
+
+                last_chunk_at = time.time()
+
+                if first_chunk_at is None:
+                    first_chunk_at = last_chunk_at
+
+                if (chunk["choices"][0].get("delta") or {}).get("content"):
+                    yield chunk
+
+        if first_chunk_at is not None:
+            stats.prefill_seconds += first_chunk_at - sent_at
+            stats.generation_seconds += last_chunk_at - first_chunk_at
 
-            if chunk.choices[0].delta.content:
-                yield chunk
+        stats.n_iterations += 1
+        stats.add_usage(completion_builder.usage)
 
         completion = await completion_builder.build()
         messages.append(refine_assistant_message(completion.choices[0].message))
@@ -88,14 +250,27 @@ async def handle_request(request: ChatCompletionRequest) -> AsyncGenerator[ChatC
             _args = json.loads(_args)
 
             logger.info(f"Executing tool call: {_name} with args: {_args}")
+            tool_started_at = time.time()
             _result = await execute_openai_compatible_toolcall(_name, _args, xterm_mcp)
+            stats.tool_seconds += time.time() - tool_started_at
             logger.info(f"Tool call {_name} result: {_result}")
 
+            content = refine_mcp_response(_result)
+
+            if settings.tool_output_compression:
+                content, saved = compress_tool_result(content, _name)
+                stats.tool_chars_saved += saved
+
+                if saved > 0:
+                    # about 4 characters per token
+                    logger.info(f"Tool call {_name} output compressed by {saved} characters (~{saved // 4} tokens)")
+                    metrics.observe("tool_output_chars_saved_per_call", saved)
+
             messages.append(
                 {
                     "role": "tool",
                     "tool_call_id": _id,
-                    "content": refine_mcp_response(_result)
+                    "content": content
                 }
             )
 
@@ -103,46 +278,88 @@ async def handle_request(request: ChatCompletionRequest) -> AsyncGenerator[ChatC
 
         finished = len((completion.choices[0].message.tool_calls or [])) == 0
 
+    if session is not None:
+        session.prompt_digest = sent_digest
+        session_store.save(session, messages)
+
+    completion.usage = stats.to_usage()
     yield completion
 
 @router.post("/prompt")
-async def prompt(request: ChatCompletionRequest):
+async def prompt(request: ChatCompletionRequest, raw_request: Request):
     enqueued = time.time()
-    ttft, tps, n_tokens = float("inf"), None, 0
+    ttft = float("inf")
     req_id = request.request_id or f"req-{random_uuid()}"
+    stats = RequestStats()
+    cancelled = asyncio.Event()
+    headers = {}
+
+    if request.session_id:
+        session = session_store.peek(request.session_id)
+        headers["X-Session-Resumed"] = "true" if session is not None and session.messages else "false"
 
     if request.stream:
-        generator = handle_request(request)
+        async def to_bytes() -> AsyncGenerator[bytes, None]:
+            nonlocal ttft
+            watcher = asyncio.create_task(cancel_on_disconnect(raw_request, cancelled, asyncio.current_task()))
+
+            try:
+                async with aclosing(handle_request(request, stats)) as gen:
+                    async for chunk in gen:
+                        ttft = min(ttft, time.time() - enqueued)
 
-        async def to_bytes(gen: AsyncGenerator) -> AsyncGenerator[bytes, None]:
-            nonlocal ttft, tps, n_tokens
+                        if isinstance(chunk, dict):
+                            # upstream chunks are forwarded without re-validation
+                            yield "data: " + json.dumps(chunk) + "\n\n"
 
-            async for chunk in gen:
-                current_time = time.time()
+                        elif isinstance(chunk, ChatCompletionResponse):
+                            # final usage, aggregated over every upstream call
+                            usage_chunk = ChatCompletionStreamResponse(
+                                id=chunk.id,
+                                model=chunk.model,
+                                choices=[],
+                                usage=chunk.usage
+                            )
+                            yield "data: " + usage_chunk.model_dump_json() + "\n\n"
 
-                n_tokens += 1
-                ttft = min(ttft, current_time - enqueued)
-                tps = n_tokens / (current_time - enqueued)
+                yield "data: [DONE]\n\n"
 
-                if isinstance(chunk, ChatCompletionStreamResponse):
-                    data = chunk.model_dump_json()
-                    yield "data: " + data + "\n\n"
+            except asyncio.CancelledError:
+                if not cancelled.is_set():
+                    raise
 
-            logger.info(f"Request {req_id} - TTFT: {ttft:.2f}s, TPS: {tps:.2f} tokens/s")
-            yield "data: [DONE]\n\n"
+                asyncio.current_task().uncancel()
+                logger.info(f"Request {req_id} cancelled after client disconnect")
 
-        return StreamingResponse(to_bytes(generator), media_type="text/event-stream")
+            finally:
+                watcher.cancel()
+                logger.info(f"Request {req_id} - TTFT: {ttft:.2f}s, Total: {time.time() - enqueued:.2f}s")
+                stats.report(req_id)
+
+        return StreamingResponse(to_bytes(), media_type="text/event-stream", headers=headers)
     
     else:
-        async for chunk in handle_request(request):
-            current_time = time.time()
+        watcher = asyncio.create_task(cancel_on_disconnect(raw_request, cancelled, asyncio.current_task()))
+
+        try:
+            async with aclosing(handle_request(request, stats)) as gen:
+                async for chunk in gen:
+                    ttft = min(ttft, time.time() - enqueued)
+
+        except asyncio.CancelledError:
+            if not cancelled.is_set():
+                raise
 
-            n_tokens += 1
-            ttft = min(ttft, current_time - enqueued)
-            tps = n_tokens / (current_time - enqueued)
+            asyncio.current_task().uncancel()
+            logger.info(f"Request {req_id} cancelled after client disconnect")
+            return JSONResponse(content={"error": "client disconnected"}, status_code=499)
 
-        logger.info(f"Request {req_id} - TTFT: {ttft:.2f}s, TPS: {tps:.2f} tokens/s")
-        return JSONResponse(chunk.model_dump())
+        finally:
+            watcher.cancel()
+
+        logger.info(f"Request {req_id} - TTFT: {ttft:.2f}s, Total: {time.time() - enqueued:.2f}s")
+        stats.report(req_id)
+        return JSONResponse(chunk.model_dump(), headers=headers)
 
 @router.get("/processing-url")
 async def get_processing_url():
@@ -153,3 +370,7 @@ async def get_processing_url():
         },
         status_code=200
     )
+
+@router.get("/metrics")
+async def get_metrics():
+    return JSONResponse(content=metrics.snapshot(), status_code=200)
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+
+from .configs import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# base64 characters decoded per step, a multiple of 4
+DECODE_CHUNK_SIZE = 4 << 20
+DIGEST_PATTERN = re.compile(r'(?:sha256:)?([0-9a-f]{64})')
+_DATA_URL = re.compile(r'data:([^;,]*)(;[^,]*)?,')
+
+_TEXT_MIME_TYPES = {
+    "application/json", "application/xml", "application/javascript",
+    "application/x-yaml", "application/yaml", "application/toml", "application/x-sh",
+}
+
+class AttachmentError(Exception):
+    pass
+
+@dataclass
+class Attachment:
+    digest: str
+    filename: str
+    mime_type: str
+    size: int
+    path: str
+
+    @property
+    def reference(self) -> str:
+        return f"{self.filename} (sha256:{self.digest}, {self.mime_type}, {self.size} bytes): {self.path}"
+
+class AttachmentStore:
+    """
+    Content-addressed store of /prompt file attachments.
+
+    Files are stored once under their sha256, whatever turn or session
+    they arrive in. Encoded payloads that were seen before are recognised
+    by a digest of their base64 text, so they are not decoded or written
+    again. Text is extracted lazily, on first read, and cached next to the
+    file.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_known: int = 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_known = max_known
+        # digest of the base64 text -> digest of the content
+        self._known: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str, suffix: str = '') -> str:
+        return os.path.join(self.root, digest[:2], digest + suffix)
+
+    def get(self, digest: str) -> Optional[Attachment]:
+        match = DIGEST_PATTERN.fullmatch(digest)
+
+        if match is None:
+            return None
+
+        digest = match.group(1)
+        path = self._path(digest)
+
+        try:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+
+        except (OSError, ValueError):
+            return None
+
+        return Attachment(digest=digest, path=path, **meta)
+
+    def _remember(self, encoded_digest: str, digest: str) -> None:
+        with self._lock:
+            self._known[encoded_digest] = digest
+            self._known.move_to_end(encoded_digest)
+
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+
+    def _decode_to(self, data: str, f) -> tuple[str, int]:
+        # line-wrapped base64 would throw the chunks out of alignment
+        if any(c in data for c in ' \n\r\t'):
+            data = ''.join(data.split())
+
+        hasher, size = hashlib.sha256(), 0
+
+        for i in range(0, len(data), DECODE_CHUNK_SIZE):
+            try:
+                chunk = base64.b64decode(data[i:i + DECODE_CHUNK_SIZE], validate=False)
+
+            except (binascii.Error, ValueError) as e:
+                raise AttachmentError(f"invalid base64 data: {e}") from e
+
+            size += len(chunk)
+
+            if size > self.max_bytes:
+                raise AttachmentError(f"attachment is larger than {self.max_bytes} bytes")
+
+            hasher.update(chunk)
+            f.write(chunk)
+
+        return hasher.hexdigest(), size
+
+    def ingest(self, data: str, filename: Optional[str] = None, mime_type: Optional[str] = None) -> Attachment:
+        """
+        Stores base64 `data` (optionally a data: URL) and returns its entry.
+        """
+        match = _DATA_URL.match(data)
+
+        if match is not None:
+            mime_type = mime_type or match.group(1) or None
+            data = data[match.end():]
+
+        encoded_digest = hashlib.sha256(data.encode('ascii', errors='replace')).hexdigest()
+
+        with self._lock:
+            known = self._known.get(encoded_digest)
+
+        if known is not None and (attachment := self.get(known)) is not None:
+            metrics.inc("attachments_deduplicated")
+            return attachment
+
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                digest, size = self._decode_to(data, f)
+
+            path = self._path(digest)
+
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                metrics.inc("attachments_deduplicated")
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                metrics.inc("attachments_stored")
+                metrics.observe("attachment_bytes", size)
+
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+            raise
+
+        filename = os.path.basename(filename or '') or f"attachment-{digest[:12]}"
+        mime_type = mime_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        # the first name a content was seen under is kept
+        if not os.path.exists(path + '.json'):
+            with open(path + '.json', 'w') as f:
+                json.dump({"filename": filename, "mime_type": mime_type, "size": size}, f)
+
+        self._remember(encoded_digest, digest)
+        return self.get(digest)
+
+    def text_path(self, attachment: Attachment) -> str:
+        """Path of the attachment's text, extracted on first use."""
+        if attachment.mime_type.startswith("text/") or attachment.mime_type in _TEXT_MIME_TYPES:
+            return attachment.path
+
+        text_path = attachment.path + '.txt'
+
+        if os.path.exists(text_path):
+            return text_path
+
+        text = self._extract(attachment)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(text_path), prefix='.text-')
+
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+        os.replace(tmp_path, text_path)
+        metrics.inc("attachment_text_extractions")
+        return text_path
+
+    def _extract(self, attachment: Attachment) -> str:
+        if attachment.mime_type == "application/pdf":
+            try:
+                from pypdf import PdfReader
+
+            except ImportError:
+                raise AttachmentError("text extraction from PDF needs the pypdf package")
+
+            reader = PdfReader(attachment.path)
+            return '\n\n'.join(page.extract_text() or '' for page in reader.pages)
+
+        with open(attachment.path, 'rb') as f:
+            head = f.read(8192)
+
+        if b'\0' in head:
+            raise AttachmentError(f"no text can be extracted from {attachment.mime_type} files")
+
+        with open(attachment.path, encoding='utf-8', errors='replace') as f:
+            return f.read()
+
+attachment_store = AttachmentStore(
+    root=settings.attachments_dir,
+    max_bytes=settings.attachments_max_bytes
+)
@@ -6,6 +6,16 @@ class Settings(BaseSettings):
     llm_base_url: str = Field(alias="LLM_BASE_URL", default="https://api.openai.com/v1")
     llm_model_id: str = Field(alias="LLM_MODEL_ID", default="gpt-4o-mini")
 
+    # how the upstream continues a partial assistant message:
+    # "none" (no prefill), "assistant" (trailing assistant message is a prefill),
+    # "vllm" (trailing assistant message + continue_final_message)
+    llm_prefill_mode: str = Field(alias="LLM_PREFILL_MODE", default="none")
+
+    # where the current time goes: "user" (latest user turn, keeps the prompt prefix
+    # cacheable) or "system" (system prompt); granularity: "second", "minute", "hour", "day"
+    prompt_time_placement: str = Field(alias="PROMPT_TIME_PLACEMENT", default="user")
+    prompt_time_granularity: str = Field(alias="PROMPT_TIME_GRANULARITY", default="minute")
+
     # app state
     app_env: str = Field(alias="APP_ENV", default="development")
 
@@ -13,6 +23,59 @@ class Settings(BaseSettings):
     host: str = Field(alias="HOST", default="0.0.0.0")
     port: int = Field(alias="PORT", default=80)
 
+    # /prompt sessions
+    session_ttl_seconds: float = Field(alias="SESSION_TTL_SECONDS", default=60.0 * 60)
+    session_max_entries: int = Field(alias="SESSION_MAX_ENTRIES", default=128)
+    session_max_messages: int = Field(alias="SESSION_MAX_MESSAGES", default=512)
+
+    # /prompt file attachments, stored by content digest
+    attachments_dir: str = Field(alias="ATTACHMENTS_DIR", default="/tmp/attachments")
+    attachments_max_bytes: int = Field(alias="ATTACHMENTS_MAX_BYTES", default=100 * 1024 * 1024)
+
+    # terminal sessions, 0 shares the single legacy session
+    terminal_pool_size: int = Field(alias="TERMINAL_POOL_SIZE", default=4)
+    # "fast" sends commands at once, "animated" simulates typing,
+    # "auto" animates only while someone watches the session through ttyd
+    terminal_typing_mode: str = Field(alias="TERMINAL_TYPING_MODE", default="auto")
+    # commands are interrupted after this long; Ctrl-C first, then their process group is killed
+    terminal_command_timeout: float = Field(alias="TERMINAL_COMMAND_TIMEOUT", default=300.0)
+    terminal_kill_grace_seconds: float = Field(alias="TERMINAL_KILL_GRACE_SECONDS", default=2.0)
+    # output kept in memory per command; longer output is spilled to disk for read_output
+    terminal_output_head_chars: int = Field(alias="TERMINAL_OUTPUT_HEAD_CHARS", default=10000)
+    terminal_output_tail_chars: int = Field(alias="TERMINAL_OUTPUT_TAIL_CHARS", default=30000)
+    terminal_spill_dir: str = Field(alias="TERMINAL_SPILL_DIR", default="/tmp/command-output")
+    terminal_spill_max_files: int = Field(alias="TERMINAL_SPILL_MAX_FILES", default=64)
+    # collapse repetitive tool output (repeated lines, stack traces) before it enters the context
+    tool_output_compression: bool = Field(alias="TOOL_OUTPUT_COMPRESSION", default=True)
+
+    # background jobs
+    jobs_max_running: int = Field(alias="JOBS_MAX_RUNNING", default=8)
+    jobs_max_finished: int = Field(alias="JOBS_MAX_FINISHED", default=32)
+    # a job's output file is cut back to its newest half past this size
+    jobs_max_output_bytes: int = Field(alias="JOBS_MAX_OUTPUT_BYTES", default=64 << 20)
+
+    # internet_search
+    search_proxy_url: str = Field(alias="ETERNALAI_MCP_PROXY_URL", default="")
+    search_cache_ttl_seconds: float = Field(alias="SEARCH_CACHE_TTL_SECONDS", default=600.0)
+    search_cache_max_entries: int = Field(alias="SEARCH_CACHE_MAX_ENTRIES", default=256)
+    search_timeout: float = Field(alias="SEARCH_TIMEOUT", default=30.0)
+
+    # client disconnects
+    disconnect_poll_seconds: float = Field(alias="DISCONNECT_POLL_SECONDS", default=1.0)
+    cancel_grace_seconds: float = Field(alias="CANCEL_GRACE_SECONDS", default=5.0)
+
+    # upstream retries
+    upstream_max_retries: int = Field(alias="UPSTREAM_MAX_RETRIES", default=2)
+    upstream_retry_backoff_seconds: float = Field(alias="UPSTREAM_RETRY_BACKOFF_SECONDS", default=1.0)
+
+    # upstream stall deadlines, per route (/prompt and /v1/messages)
+    prompt_connect_timeout: float = Field(alias="PROMPT_CONNECT_TIMEOUT", default=10.0)
+    prompt_first_byte_timeout: float = Field(alias="PROMPT_FIRST_BYTE_TIMEOUT", default=180.0)
+    prompt_idle_timeout: float = Field(alias="PROMPT_IDLE_TIMEOUT", default=90.0)
+    messages_connect_timeout: float = Field(alias="MESSAGES_CONNECT_TIMEOUT", default=10.0)
+    messages_first_byte_timeout: float = Field(alias="MESSAGES_FIRST_BYTE_TIMEOUT", default=180.0)
+    messages_idle_timeout: float = Field(alias="MESSAGES_IDLE_TIMEOUT", default=90.0)
+
     class Config:
         env_file = ".env"
         case_sensitive = False
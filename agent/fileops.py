@@ -0,0 +1,219 @@
+from dataclasses import dataclass
+from typing import Optional
+import mmap
+import os
+import re
+import tempfile
+
+WRITE_CHUNK_SIZE = 1 << 20
+# most a single read returns, the caller pages through bigger ranges
+READ_MAX_BYTES = 256 * 1024
+
+class PatchError(Exception):
+    pass
+
+def write_atomic(path: str, content: str, append: bool = False) -> int:
+    """
+    Writes `content` to `path` in chunks and returns the number of bytes
+    written. An overwrite goes to a temporary file in the same directory
+    that is renamed over `path`, so readers never see a partial file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if append:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        tmp_path = None
+    else:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.")
+
+    written = 0
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for i in range(0, len(content), WRITE_CHUNK_SIZE):
+                written += f.write(content[i:i + WRITE_CHUNK_SIZE].encode('utf-8'))
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        if tmp_path is not None:
+            # keep the permissions of the file being replaced
+            try:
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                os.chmod(tmp_path, 0o644)
+
+            os.replace(tmp_path, path)
+
+    except BaseException:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        raise
+
+    return written
+
+@dataclass
+class FileSlice:
+    text: str
+    start: int
+    end: int
+    size: int
+    truncated: bool = False
+
+def read_lines(path: str, start_line: int, end_line: Optional[int]) -> FileSlice:
+    """
+    Lines `start_line`..`end_line` (1-based, inclusive) of `path`. Only the
+    bytes up to the end of the range are touched, through a memory map.
+    """
+    start_line = max(start_line, 1)
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size == 0:
+            return FileSlice(text='', start=start_line, end=start_line - 1, size=0)
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos, line = 0, 1
+
+            while line < start_line and pos < size:
+                nl = mm.find(b'\n', pos)
+                pos = size if nl < 0 else nl + 1
+                line += 1
+
+            begin, last = pos, line - 1
+
+            while pos < size and (end_line is None or last < end_line):
+                if pos - begin >= READ_MAX_BYTES:
+                    break
+
+                nl = mm.find(b'\n', pos)
+                pos = size if nl < 0 else nl + 1
+                last += 1
+
+            truncated = pos < size and (end_line is None or last < end_line)
+            return FileSlice(
+                text=mm[begin:pos].decode('utf-8', errors='replace'),
+                start=start_line,
+                end=last,
+                size=size,
+                truncated=truncated
+            )
+
+def read_bytes(path: str, offset: int, length: int) -> FileSlice:
+    length = max(0, min(length, READ_MAX_BYTES))
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = max(0, min(offset, size))
+
+        if size == 0:
+            return FileSlice(text='', start=0, end=0, size=0)
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = min(offset + length, size)
+            return FileSlice(
+                text=mm[offset:end].decode('utf-8', errors='replace'),
+                start=offset,
+                end=end,
+                size=size,
+                truncated=end < size
+            )
+
+def is_binary(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return b'\0' in f.read(8192)
+
+def search_replace(content: str, search: str, replace: str) -> str:
+    if not search:
+        raise PatchError("search text is empty")
+
+    count = content.count(search)
+
+    if count == 0:
+        raise PatchError("search text not found")
+
+    if count > 1:
+        raise PatchError(f"search text is ambiguous, it occurs {count} times; include more context")
+
+    return content.replace(search, replace, 1)
+
+_HUNK = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def _parse_hunks(diff: str) -> list[list]:
+    """[old start line, old lines, new lines, added count, removed count] per hunk"""
+    hunks, current = [], None
+
+    for line in diff.splitlines():
+        match = _HUNK.match(line)
+
+        if match is not None:
+            current = [int(match.group(1)), [], [], 0, 0]
+            hunks.append(current)
+            continue
+
+        # file headers come before the first hunk
+        if current is None or line.startswith('\\'):
+            continue
+
+        tag, text = (line[:1], line[1:]) if line else (' ', '')
+
+        if tag not in (' ', '-', '+'):
+            raise PatchError(f"unexpected diff line: {line[:80]!r}")
+
+        if tag in (' ', '-'):
+            current[1].append(text)
+
+        if tag in (' ', '+'):
+            current[2].append(text)
+
+        current[3] += tag == '+'
+        current[4] += tag == '-'
+
+    if not hunks:
+        raise PatchError("no hunks found in diff")
+
+    return hunks
+
+def _find_block(lines: list[str], block: list[str], hint: int) -> int:
+    # exact position first, then the closest match around it
+    candidates = sorted(range(len(lines) - len(block) + 1), key=lambda i: abs(i - hint))
+
+    for i in candidates:
+        if lines[i:i + len(block)] == block:
+            return i
+
+    return -1
+
+def apply_unified_diff(content: str, diff: str) -> tuple[str, int, int]:
+    """
+    Applies a unified diff to `content`. Hunks are located by their context,
+    starting at the line numbers they declare, so slightly stale numbers
+    still apply. Returns the new content and the added/removed line counts.
+    """
+    trailing_newline = content.endswith('\n')
+    lines = content.split('\n')
+
+    if trailing_newline:
+        lines.pop()
+
+    added = removed = 0
+    shift = 0
+
+    for n, (old_start, old, new, n_added, n_removed) in enumerate(_parse_hunks(diff), start=1):
+        if old:
+            at = _find_block(lines, old, max(old_start - 1 + shift, 0))
+        else:
+            # a pure insertion goes after line `old_start`
+            at = min(max(old_start + shift, 0), len(lines))
+
+        if at < 0:
+            raise PatchError(f"hunk {n} does not apply, its context was not found")
+
+        lines[at:at + len(old)] = new
+        shift += len(new) - len(old)
+        added += n_added
+        removed += n_removed
+
+    return '\n'.join(lines) + ('\n' if trailing_newline else ''), added, removed
@@ -0,0 +1,224 @@
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Optional
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import time
+
+from .configs import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# how often a running job's output size is checked against the cap
+OUTPUT_CHECK_SECONDS = 2.0
+
+@dataclass
+class Job:
+    job_id: str
+    command: str
+    cwd: str
+    output_path: str
+    process: asyncio.subprocess.Process
+    # lease owner of the request that started the job
+    owner: Optional[str] = field(default=None)
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = field(default=None)
+    return_code: Optional[int] = field(default=None)
+    # where the next incremental job_output read starts
+    read_offset: int = field(default=0)
+    # bytes cut from the start of the output file; offsets count them too
+    dropped: int = field(default=0)
+    waiter: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def running(self) -> bool:
+        return self.process.returncode is None
+
+    @property
+    def output_size(self) -> int:
+        try:
+            return self.dropped + os.path.getsize(self.output_path)
+
+        except OSError:
+            return self.dropped
+
+    def status(self) -> str:
+        if self.running:
+            state = f"running for {time.time() - self.started_at:.0f}s"
+        else:
+            finished_at = self.finished_at or time.time()
+            state = f"exited with code {self.process.returncode} after {finished_at - self.started_at:.0f}s"
+
+        return f"Job {self.job_id} ({self.command!r}) {state}, {self.output_size} bytes of output"
+
+class JobManager:
+    """
+    Long-running commands executed outside the terminal.
+
+    Each job runs in its own process group, with stdout and stderr going
+    straight to a file, so a job costs no event loop work while it runs and
+    its output can be read incrementally by byte offset.
+
+    Jobs belong to the lease owner of the request that started them, and
+    are only visible to that owner. An output file that grows past
+    `max_output_bytes` is cut back to its newest half.
+    """
+
+    def __init__(self, output_dir: str, max_running: int, max_finished: int, max_output_bytes: int):
+        self.output_dir = output_dir
+        self.max_running = max_running
+        self.max_finished = max_finished
+        self.max_output_bytes = max_output_bytes
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def _n_running(self) -> int:
+        return sum(job.running for job in self.jobs.values())
+
+    def _prune(self) -> None:
+        finished = [job for job in self.jobs.values() if not job.running]
+
+        for job in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self.jobs[job.job_id]
+
+            with suppress(OSError):
+                os.remove(job.output_path)
+
+    def _truncate(self, job: Job) -> None:
+        try:
+            size = os.path.getsize(job.output_path)
+
+        except OSError:
+            return
+
+        if size <= self.max_output_bytes:
+            return
+
+        keep = self.max_output_bytes // 2
+
+        # the job appends, so after the truncation its writes land after the kept tail;
+        # a write racing the cut may be lost
+        with open(job.output_path, 'r+b') as f:
+            f.seek(size - keep)
+            tail = f.read(keep)
+            f.seek(0)
+            f.truncate()
+            f.write(tail)
+
+        job.dropped += size - len(tail)
+        metrics.inc("job_output_truncations")
+        logger.info(f"Job {job.job_id} output cut to its last {len(tail)} bytes, {job.dropped} dropped so far")
+
+    async def _wait(self, job: Job) -> None:
+        exited = asyncio.ensure_future(job.process.wait())
+
+        while not exited.done():
+            await asyncio.wait({exited}, timeout=OUTPUT_CHECK_SECONDS)
+            await asyncio.to_thread(self._truncate, job)
+
+        job.return_code = exited.result()
+        job.finished_at = time.time()
+        metrics.set("jobs_running", self._n_running())
+        metrics.observe("job_seconds", job.finished_at - job.started_at)
+        logger.info(job.status())
+
+    async def start(self, command: str, cwd: str, owner: Optional[str] = None) -> Job:
+        if self._n_running() >= self.max_running:
+            raise RuntimeError(f"too many running jobs ({self.max_running}), cancel or wait for one first")
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        job_id = secrets.token_hex(4)
+        output_path = os.path.join(self.output_dir, f"{job_id}.log")
+
+        # appending, so the output file can be cut back while the job runs
+        with open(output_path, 'ab') as output:
+            process = await asyncio.create_subprocess_shell(
+                command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=output,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=cwd,
+                env=dict(os.environ),
+                start_new_session=True
+            )
+
+        job = Job(job_id=job_id, command=command, cwd=cwd, output_path=output_path, process=process, owner=owner)
+        self.jobs[job_id] = job
+        job.waiter = asyncio.create_task(self._wait(job))
+
+        self._prune()
+        metrics.inc("jobs_started")
+        metrics.set("jobs_running", self._n_running())
+        logger.info(f"Started job {job_id} (pid {process.pid}): {command}")
+        return job
+
+    def get(self, job_id: str, owner: Optional[str] = None) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+
+    def owned(self, owner: Optional[str]) -> list[Job]:
+        return [job for job in self.jobs.values() if job.owner == owner]
+
+    def read(self, job: Job, offset: Optional[int], max_bytes: int) -> tuple[bytes, int, int]:
+        """
+        Output from `offset`, or from where the last read stopped; returns
+        the bytes, their start offset and the offset to continue from.
+        """
+        # output that was cut off is skipped
+        start = max(job.read_offset if offset is None else offset, job.dropped)
+
+        with open(job.output_path, 'rb') as f:
+            f.seek(start - job.dropped)
+            data = f.read(max_bytes)
+
+        # while the job runs, stop at a line boundary so lines are not split
+        if job.running and len(data) == max_bytes and b'\n' in data:
+            data = data[:data.rindex(b'\n') + 1]
+
+        job.read_offset = start + len(data)
+        return data, start, job.read_offset
+
+    async def cancel(self, job: Job, grace: float) -> None:
+        """SIGINT, then SIGTERM, then SIGKILL to the job's process group."""
+        if job.running:
+            metrics.inc("jobs_cancelled")
+
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGKILL):
+            if not job.running:
+                break
+
+            with suppress(ProcessLookupError):
+                os.killpg(job.process.pid, sig)
+
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(asyncio.shield(job.process.wait()), timeout=grace)
+
+        # background children ignore SIGINT and may outlive the shell
+        with suppress(ProcessLookupError):
+            os.killpg(job.process.pid, signal.SIGKILL)
+
+    def release(self, owner: Optional[str]) -> None:
+        """Cancels the owner's running jobs in the background."""
+        for job in self.owned(owner):
+            if job.running:
+                logger.info(f"Cancelling job {job.job_id}, its owner {owner} is gone")
+                task = asyncio.ensure_future(self.cancel(job, grace=settings.terminal_kill_grace_seconds))
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def stop(self) -> None:
+        await asyncio.gather(*[
+            self.cancel(job, grace=1.0)
+            for job in self.jobs.values()
+            if job.running
+        ])
+
+job_manager = JobManager(
+    output_dir=os.path.join(settings.terminal_spill_dir, "jobs"),
+    max_running=settings.jobs_max_running,
+    max_finished=settings.jobs_max_finished,
+    max_output_bytes=settings.jobs_max_output_bytes
+)
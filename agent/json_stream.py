@@ -0,0 +1,236 @@
+from typing import Optional
+import re
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_NUMBER = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?')
+_LITERALS = ("true", "false", "null")
+_HEX = set("0123456789abcdefABCDEF")
+
+# what the scanner expects next
+_VALUE, _KEY_OR_END, _KEY, _COLON, _COMMA_OR_END, _VALUE_OR_END, _DONE = range(7)
+
+class IncrementalJSONScanner:
+    """
+    Tracks the structure of a JSON document fed in fragments.
+
+    Each fragment is scanned once (O(len(fragment))), without keeping the
+    text, so streamed tool arguments can be checked for completeness as they
+    arrive. `closing_suffix` and `repair` use the tracked state to complete a
+    truncated document without a full re-parse.
+    """
+
+    __slots__ = (
+        "stack", "expect", "in_string", "string_is_key", "escape",
+        "unicode_left", "scalar", "started", "malformed", "trailing_comma"
+    )
+
+    def __init__(self):
+        self.stack: list[str] = []
+        self.expect = _VALUE
+        self.in_string = False
+        self.string_is_key = False
+        self.escape = False
+        self.unicode_left = 0
+        self.scalar = ''
+        self.started = False
+        self.malformed = False
+        self.trailing_comma = False
+
+    @property
+    def complete(self) -> bool:
+        return self.expect == _DONE and not self.malformed
+
+    def _after_value(self) -> None:
+        if not self.stack:
+            self.expect = _DONE
+        else:
+            self.expect = _COMMA_OR_END
+
+    def _end_scalar(self) -> bool:
+        scalar, self.scalar = self.scalar, ''
+
+        if scalar in _LITERALS or _NUMBER.fullmatch(scalar):
+            self._after_value()
+            return True
+
+        self.malformed = True
+        return False
+
+    def _scan_string(self, fragment: str, i: int) -> int:
+        n = len(fragment)
+
+        while i < n:
+            if self.unicode_left:
+                if fragment[i] not in _HEX:
+                    self.malformed = True
+                    return n
+
+                self.unicode_left -= 1
+                i += 1
+                continue
+
+            if self.escape:
+                self.escape = False
+
+                if fragment[i] == 'u':
+                    self.unicode_left = 4
+
+                i += 1
+                continue
+
+            match = _STRING_SPECIAL.search(fragment, i)
+
+            if match is None:
+                return n
+
+            i = match.end()
+
+            if match.group() == '\\':
+                self.escape = True
+                continue
+
+            self.in_string = False
+
+            if self.string_is_key:
+                self.expect = _COLON
+            else:
+                self._after_value()
+
+            return i
+
+        return n
+
+    def feed(self, fragment: str) -> None:
+        i, n = 0, len(fragment)
+
+        while i < n and not self.malformed:
+            if self.in_string:
+                i = self._scan_string(fragment, i)
+                continue
+
+            c = fragment[i]
+
+            if self.scalar:
+                if c.isalnum() or c in '+-.':
+                    self.scalar += c
+                    i += 1
+                    continue
+
+                if not self._end_scalar():
+                    break
+
+            i += 1
+
+            if c in ' \t\r\n':
+                continue
+
+            expect = self.expect
+            self.started = True
+
+            if expect == _DONE:
+                self.malformed = True
+
+            elif expect == _COLON:
+                if c == ':':
+                    self.expect = _VALUE
+                else:
+                    self.malformed = True
+
+            elif expect == _COMMA_OR_END:
+                if c == ',':
+                    self.trailing_comma = True
+                    self.expect = _KEY if self.stack[-1] == '{' else _VALUE
+                elif c == '}' and self.stack[-1] == '{' or c == ']' and self.stack[-1] == '[':
+                    self.stack.pop()
+                    self._after_value()
+                else:
+                    self.malformed = True
+
+            elif c == '"' and expect in (_KEY_OR_END, _KEY):
+                self.trailing_comma = False
+                self.in_string, self.string_is_key = True, True
+
+            elif c == '}' and expect == _KEY_OR_END or c == ']' and expect == _VALUE_OR_END:
+                self.stack.pop()
+                self._after_value()
+
+            elif expect in (_VALUE, _VALUE_OR_END):
+                self.trailing_comma = False
+
+                if c == '"':
+                    self.in_string, self.string_is_key = True, False
+                elif c == '{':
+                    self.stack.append('{')
+                    self.expect = _KEY_OR_END
+                elif c == '[':
+                    self.stack.append('[')
+                    self.expect = _VALUE_OR_END
+                elif c.isalnum() or c == '-':
+                    self.scalar = c
+                else:
+                    self.malformed = True
+
+            else:
+                self.malformed = True
+
+    def _closers(self) -> str:
+        return ''.join('}' if e == '{' else ']' for e in reversed(self.stack))
+
+    def closing_suffix(self) -> Optional[str]:
+        """
+        Text that, appended to what was fed, completes the document; None if
+        the document is malformed or cannot be completed by appending.
+        """
+        if self.malformed or not self.started:
+            return None
+
+        if self.expect == _DONE and not self.scalar:
+            return ''
+
+        if self.in_string:
+            if self.unicode_left:
+                return None
+
+            # a dangling backslash is completed into an escaped backslash
+            suffix = ('\\' if self.escape else '') + '"'
+            suffix += ': null' if self.string_is_key else ''
+            return suffix + self._closers()
+
+        if self.scalar:
+            for literal in _LITERALS:
+                if literal.startswith(self.scalar):
+                    return literal[len(self.scalar):] + self._closers()
+
+            return self._closers() if _NUMBER.fullmatch(self.scalar) else None
+
+        if self.trailing_comma:
+            return None
+
+        if self.expect == _COLON:
+            return ': null' + self._closers()
+
+        if self.expect == _VALUE and self.stack:
+            return 'null' + self._closers()
+
+        if self.expect in (_KEY_OR_END, _VALUE_OR_END, _COMMA_OR_END):
+            return self._closers()
+
+        return None
+
+    def repair(self, text: str) -> Optional[str]:
+        """
+        Targeted repair of the fed `text`; None when a generic repair is needed.
+        """
+        if not self.started:
+            return '{}' if not text.strip() else None
+
+        suffix = self.closing_suffix()
+
+        if suffix is not None:
+            return text + suffix
+
+        if self.trailing_comma and not self.malformed:
+            stripped = text.rstrip()
+            return stripped[:-1] + self._closers()
+
+        return None
@@ -0,0 +1,152 @@
+from typing import Optional
+import asyncio
+import codecs
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# a safety net for missed events (truncation, log rotation), not a poll loop
+EVENT_TIMEOUT = 1.0
+POLL_MIN_INTERVAL = 0.02
+POLL_MAX_INTERVAL = 0.3
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.calcsize("iIII")
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+        return libc
+
+    except (OSError, AttributeError):
+        return None
+
+_libc = _load_libc()
+
+def _inotify_watch(path: str) -> Optional[int]:
+    if _libc is None:
+        return None
+
+    fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+
+    if fd < 0:
+        return None
+
+    if _libc.inotify_add_watch(fd, os.fsencode(path), _IN_MODIFY | _IN_CLOSE_WRITE) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+class LogWatcher:
+    """
+    Follows a growing log file without polling.
+
+    Wakes up on inotify events for the file, reads whatever was appended in
+    large chunks and decodes it incrementally, so a multi-byte character
+    split across two writes is never mangled. Falls back to a short,
+    backing-off poll where inotify is not available.
+    """
+
+    def __init__(self, path: str, offset: int = 0):
+        self.path = path
+        self.wakeups = 0
+        self._fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._notify_fd = _inotify_watch(path)
+        self._poll_interval = POLL_MIN_INTERVAL
+
+        os.lseek(self._fd, offset, os.SEEK_SET)
+
+        if self._notify_fd is not None:
+            self._loop.add_reader(self._notify_fd, self._on_notify)
+
+    @property
+    def event_driven(self) -> bool:
+        return self._notify_fd is not None
+
+    def _on_notify(self) -> None:
+        # drain the queued events, their content does not matter
+        try:
+            while len(os.read(self._notify_fd, 64 * _EVENT_HEADER)) > 0:
+                pass
+
+        except BlockingIOError:
+            pass
+
+        self._event.set()
+
+    def read_nowait(self) -> str:
+        """Returns what was appended so far, without waiting."""
+        parts = []
+
+        while True:
+            data = os.read(self._fd, READ_CHUNK_SIZE)
+
+            if not data:
+                break
+
+            parts.append(self._decoder.decode(data))
+
+            if len(data) < READ_CHUNK_SIZE:
+                break
+
+        return "".join(parts)
+
+    def _check_truncated(self) -> None:
+        # the log is truncated between commands; restart from its beginning
+        if os.fstat(self._fd).st_size < os.lseek(self._fd, 0, os.SEEK_CUR):
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            self._decoder.reset()
+
+    async def read(self) -> str:
+        """Waits until the log grows and returns the newly appended text."""
+        while True:
+            self._event.clear()
+            text = self.read_nowait()
+
+            if text:
+                self._poll_interval = POLL_MIN_INTERVAL
+                return text
+
+            self._check_truncated()
+            self.wakeups += 1
+
+            if self.event_driven:
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout=EVENT_TIMEOUT)
+
+                except asyncio.TimeoutError:
+                    pass
+
+            else:
+                await asyncio.sleep(self._poll_interval)
+                self._poll_interval = min(self._poll_interval * 2, POLL_MAX_INTERVAL)
+
+    def close(self) -> None:
+        if self._notify_fd is not None:
+            self._loop.remove_reader(self._notify_fd)
+            os.close(self._notify_fd)
+            self._notify_fd = None
+
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self) -> "LogWatcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,49 @@
+from collections import defaultdict
+from typing import Any
+import threading
+
+class Metrics:
+    """
+    Process-wide counters and summaries, exposed by the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = defaultdict(float)
+        self._gauges: dict[str, float] = {}
+        self._summaries: dict[str, dict[str, float]] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            summary = self._summaries.setdefault(
+                name, {"count": 0, "sum": 0.0, "max": 0.0, "last": 0.0}
+            )
+
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+            summary["last"] = value
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {
+                    name: {
+                        **summary,
+                        "avg": summary["sum"] / summary["count"] if summary["count"] else 0.0
+                    }
+                    for name, summary in self._summaries.items()
+                }
+            }
+
+metrics = Metrics()
@@ -336,6 +336,15 @@ class ChatCompletionRequest(OpenAIBaseModel):
             "not set it, a random_uuid will be generated. This id is used "
             "through out the inference process and return in response."),
     )
+    session_id: Optional[str] = Field(
+        default=None,
+        description=(
+            "If specified, the server keeps the refined conversation "
+            "(including tool messages) under this id, and subsequent "
+            "requests only need to carry the new messages. If the session "
+            "is unknown or expired, the messages are treated as the full "
+            "history."),
+    )
     logits_processors: Optional[LogitsProcessors] = Field(
         default=None,
         description=(
@@ -1,9 +1,16 @@
-from .oai_models import ChatCompletionResponse, ChatCompletionStreamResponse, ToolCall, random_uuid, ErrorResponse
+from .oai_models import ChatCompletionResponse, ToolCall, UsageInfo, random_uuid, ErrorResponse
 import httpx
 import json
-from typing import AsyncGenerator
+from typing import AsyncGenerator, AsyncIterator, Any, Optional, TypeVar
+from contextlib import aclosing
+from dataclasses import dataclass
+import asyncio
 import logging
+import time
 from json_repair import repair_json
+from .json_stream import IncrementalJSONScanner
+from .configs import settings
+from .metrics import metrics
 
 def repair_json_no_except(json_str: str) -> str:
     try:
@@ -19,6 +26,78 @@ def repair_json_no_except(json_str: str) -> str:
         return json_str
 
 logger = logging.getLogger(__name__)
+T = TypeVar('T')
+
+@dataclass
+class StreamDeadlines:
+    route: str
+    connect: float
+    first_byte: float
+    idle: float
+
+    @classmethod
+    def for_route(cls, route: str) -> "StreamDeadlines":
+        return cls(
+            route=route,
+            connect=getattr(settings, f"{route}_connect_timeout"),
+            first_byte=getattr(settings, f"{route}_first_byte_timeout"),
+            idle=getattr(settings, f"{route}_idle_timeout"),
+        )
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        # the watchdog enforces first-byte and idle deadlines separately
+        return httpx.Timeout(max(self.first_byte, self.idle), connect=self.connect)
+
+class StreamStalled(Exception):
+    def __init__(self, route: str, kind: str, timeout: float):
+        super().__init__(f"{route} upstream stream stalled: no {kind.replace('_', ' ')} within {timeout:.0f}s")
+        self.route = route
+        self.kind = kind
+
+def record_stall(route: str, kind: str) -> None:
+    metrics.inc(f"upstream_stalls_{route}_{kind}")
+
+async def watch_stream(
+    iterator: AsyncIterator[T],
+    deadlines: StreamDeadlines,
+    started_at: Optional[float] = None
+) -> AsyncGenerator[T, None]:
+    """
+    Re-yield `iterator`, raising StreamStalled when the first item does not
+    arrive within the first-byte deadline (counted from `started_at`) or when
+    the stream goes idle for longer than the idle deadline.
+    """
+    it = iterator.__aiter__()
+    loop = asyncio.get_running_loop()
+    started_at = started_at or time.time()
+    kind = "first_byte"
+
+    # one deadline for the whole stream, moved after every item rather than
+    # a wait_for, and so a task, per item
+    deadline = asyncio.timeout_at(loop.time() + max(0.0, deadlines.first_byte - (time.time() - started_at)))
+
+    try:
+        async with deadline:
+            while True:
+                try:
+                    item = await it.__anext__()
+
+                except StopAsyncIteration:
+                    return
+
+                # the consumer's time with the item does not count
+                deadline.reschedule(None)
+                yield item
+
+                kind = "idle"
+                deadline.reschedule(loop.time() + deadlines.idle)
+
+    except TimeoutError:
+        if not deadline.expired():
+            raise
+
+        record_stall(deadlines.route, kind)
+        raise StreamStalled(deadlines.route, kind, deadlines.first_byte if kind == "first_byte" else deadlines.idle)
 
 def reconstruct_curl_request(
     base_url: str,
@@ -28,42 +107,113 @@ def reconstruct_curl_request(
     return f'curl -X POST "{base_url}/chat/completions" -H "Authorization: Bearer {api_key}" -H "Content-Type: application/json" -d \'{json.dumps(payload_to_call)}\''
 
 class ChatCompletionResponseBuilder:
+    """
+    Assembles streamed chunks into a ChatCompletionResponse.
+
+    Content and tool-call fragments are collected in lists and joined once in
+    `build`. Tool-call deltas are routed by their `index`, so interleaved
+    parallel calls are assembled independently.
+    """
+
     def __init__(self):
-        self.msg, self.calls_by_idx, self.finished_reason, self.model_id, self.completion_id = '', {}, '', '', ''
-        self.calls = []
-
-    def add_chunk(self, chunk: ChatCompletionStreamResponse):
-        choice = chunk.choices[0]
-
-        if choice.delta.content:
-            self.msg += choice.delta.content
-
-        elif choice.delta.tool_calls:
-            for tool_call in choice.delta.tool_calls:
-                if tool_call.function.name is not None:
-                    self.calls.append({
-                        "id": "call_" + random_uuid()[-20:],
-                        "type": tool_call.type,
-                        "function": {
-                            "name": tool_call.function.name,
-                            "arguments": tool_call.function.arguments or ""
-                        }
-                    })
-
-                elif len(self.calls) > 0:
-                    self.calls[-1]["function"]["arguments"] += tool_call.function.arguments
-
-        self.finished_reason = choice.finish_reason
-        self.model_id = chunk.model
-        self.completion_id = chunk.id
+        self.msg_parts: list[str] = []
+        self.calls: list[dict[str, Any]] = []
+        self.calls_by_idx: dict[int, dict[str, Any]] = {}
+        self.finished_reason, self.model_id, self.completion_id = '', '', ''
+        self.usage: UsageInfo | None = None
+
+    def _new_call(self, index: int) -> dict[str, Any]:
+        call = {"id": None, "type": "function", "name": [], "arguments": [], "scanner": IncrementalJSONScanner()}
+        self.calls.append(call)
+        self.calls_by_idx[index] = call
+        return call
+
+    def _route(self, tool_call: dict[str, Any]) -> dict[str, Any]:
+        index = tool_call.get("index")
+        name = (tool_call.get("function") or {}).get("name")
+
+        if index is None:
+            # upstreams without indices: a name starts the next call
+            if name is not None or not self.calls:
+                return self._new_call(len(self.calls))
+
+            return self.calls[-1]
+
+        call = self.calls_by_idx.get(index)
+
+        # some upstreams reuse an index for consecutive calls
+        if call is not None and name and call["name"] and tool_call.get("id") not in (None, call["id"]):
+            call = None
+
+        return call if call is not None else self._new_call(index)
+
+    def add_chunk(self, chunk: dict[str, Any]):
+        if chunk.get("usage") is not None:
+            self.usage = UsageInfo.model_validate(chunk["usage"])
+
+        if not chunk.get("choices"):
+            return chunk
+
+        choice = chunk["choices"][0]
+        delta = choice.get("delta") or {}
+
+        if delta.get("content"):
+            self.msg_parts.append(delta["content"])
+
+        tool_calls = delta.get("tool_calls") or []
+
+        if not isinstance(tool_calls, list):
+            tool_calls = [tool_calls]
+
+        for tool_call in tool_calls:
+            call = self._route(tool_call)
+            function = tool_call.get("function") or {}
+
+            if tool_call.get("id") and call["id"] is None:
+                call["id"] = tool_call["id"]
+
+            if tool_call.get("type"):
+                call["type"] = tool_call["type"]
+
+            if function.get("name"):
+                call["name"].append(function["name"])
+
+            if function.get("arguments"):
+                call["arguments"].append(function["arguments"])
+                call["scanner"].feed(function["arguments"])
+
+        if choice.get("finish_reason") is not None:
+            self.finished_reason = choice["finish_reason"]
+
+        self.model_id = chunk.get("model") or self.model_id
+        self.completion_id = chunk.get("id") or self.completion_id
         return chunk
 
     async def build(self) -> ChatCompletionResponse:
         verified_calls = []
 
-        for call in self.calls:
+        for fragments in self.calls:
+            scanner: IncrementalJSONScanner = fragments["scanner"]
+            call = {
+                "id": fragments["id"] or "call_" + random_uuid()[-20:],
+                "type": fragments["type"],
+                "function": {
+                    "name": "".join(fragments["name"]),
+                    "arguments": "".join(fragments["arguments"])
+                }
+            }
+
             try:
-                call["function"]["arguments"] = repair_json_no_except(call["function"]["arguments"])
+                if not scanner.complete:
+                    arguments = call["function"]["arguments"]
+                    repaired = scanner.repair(arguments)
+
+                    if repaired is None:
+                        logger.info(f"malformed arguments for call {call['id']}, falling back to a full repair")
+                        repaired = repair_json_no_except(arguments)
+
+                    call["function"]["arguments"] = repaired
+
                 json.loads(call["function"]["arguments"])
                 ToolCall.model_validate(call)
                 verified_calls.append(call)
@@ -80,25 +230,100 @@ class ChatCompletionResponseBuilder:
                         index=0,
                         message=dict(
                             role="assistant",
-                            content=self.msg,
+                            content="".join(self.msg_parts),
                             tool_calls=verified_calls
                         ),
                         finish_reason=self.finished_reason
                     )
                 ],
-                usage=dict(
+                usage=self.usage or dict(
                     prompt_tokens=0,
                     completion_tokens=0
                 )
             )
         )
 
+class SSEDecoder:
+    """
+    Incremental decoder of server-sent events over raw byte chunks.
+
+    Lines are split on the byte buffer without decoding the whole stream;
+    every `data:` line (or bare JSON line) is returned as one payload,
+    comments (`: ping`) and other fields are dropped.
+    """
+
+    __slots__ = ("_buffer",)
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def _payload(self, line: bytes) -> bytes | None:
+        line = line.strip()
+
+        if not line.startswith(b"data:"):
+            return line if line.startswith((b"{", b"[")) else None
+
+        # some upstreams nest the prefix
+        while line.startswith(b"data:"):
+            line = line[5:].lstrip(b" ")
+
+        return line or None
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        buffer = self._buffer
+        buffer += chunk
+
+        payloads, start = [], 0
+
+        while (end := buffer.find(b"\n", start)) >= 0:
+            payload = self._payload(bytes(buffer[start:end]))
+            start = end + 1
+
+            if payload is not None:
+                payloads.append(payload)
+
+        del buffer[:start]
+        return payloads
+
+    def flush(self) -> list[bytes]:
+        payload = self._payload(bytes(self._buffer))
+        self._buffer.clear()
+        return [payload] if payload is not None else []
+
 async def create_streaming_response(
     base_url: str,
     api_key: str,
+    deadlines: Optional[StreamDeadlines] = None,
     **payload_to_call
-) -> AsyncGenerator[ChatCompletionStreamResponse, None]:
+) -> AsyncGenerator[dict[str, Any] | ErrorResponse, None]:
+    """
+    Stream chat completion chunks as plain dicts; callers validate the
+    assembled response once instead of every chunk.
+    """
+    deadlines = deadlines or StreamDeadlines.for_route("prompt")
+    started_at = time.time()
+
+    try:
+        async with aclosing(_stream_chunks(base_url, api_key, deadlines, started_at, **payload_to_call)) as stream:
+            async for chunk in stream:
+                yield chunk
+
+    except httpx.ConnectTimeout:
+        record_stall(deadlines.route, "connect")
+        raise StreamStalled(deadlines.route, "connect", deadlines.connect)
 
+    except httpx.ReadTimeout:
+        # the response headers did not arrive in time
+        record_stall(deadlines.route, "first_byte")
+        raise StreamStalled(deadlines.route, "first_byte", deadlines.first_byte)
+
+async def _stream_chunks(
+    base_url: str,
+    api_key: str,
+    deadlines: StreamDeadlines,
+    started_at: float,
+    **payload_to_call
+) -> AsyncGenerator[dict[str, Any] | ErrorResponse, None]:
     async with httpx.AsyncClient() as client:
         async with client.stream(
             "POST",
@@ -110,24 +335,23 @@ async def create_streaming_response(
             headers={
                 'Authorization': f'Bearer {api_key}'
             },
-            timeout=httpx.Timeout(60.0 * 10)
+            timeout=deadlines.httpx_timeout()
         ) as response:
 
             try:
                 response.raise_for_status()
+                decoder = SSEDecoder()
 
-                async for line in response.aiter_lines():
-                    while line.startswith('data: '):    
-                        line = line[6:].strip()
+                async def iter_payloads() -> AsyncGenerator[bytes, None]:
+                    async for raw in watch_stream(response.aiter_bytes(), deadlines, started_at):
+                        for line in decoder.feed(raw):
+                            yield line
 
-                    if line == "": 
-                        continue
-                    
-                    # check if the line is ping 
-                    if line.startswith(": ping"):
-                        continue
+                    for line in decoder.flush():
+                        yield line
 
-                    if line == "[DONE]": 
+                async for line in iter_payloads():
+                    if line == b"[DONE]":
                         break
 
                     try:
@@ -156,8 +380,93 @@ async def create_streaming_response(
                         raise e
 
                     if resp_json.get('object', '') == 'chat.completion.chunk':
-                        yield ChatCompletionStreamResponse.model_validate(resp_json)
+                        yield resp_json
 
             except Exception as e:
                 logger.error(f"Failed to stream response: {e}")
-                raise e
\ No newline at end of file
+                raise e
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+
+    return isinstance(e, (httpx.TransportError, StreamStalled))
+
+def continuation_payload(payload_to_call: dict[str, Any], partial: str, prefill_mode: str) -> dict[str, Any]:
+    payload = {
+        **payload_to_call,
+        "messages": [
+            *payload_to_call["messages"],
+            {"role": "assistant", "content": partial}
+        ]
+    }
+
+    if prefill_mode == "vllm":
+        payload.update(continue_final_message=True, add_generation_prompt=False)
+
+    return payload
+
+async def create_resumable_streaming_response(
+    base_url: str,
+    api_key: str,
+    deadlines: Optional[StreamDeadlines] = None,
+    **payload_to_call
+) -> AsyncGenerator[dict[str, Any] | ErrorResponse, None]:
+    """
+    create_streaming_response that survives dropped upstream connections.
+
+    Failed and stalled attempts are retried with exponential backoff on a
+    fresh connection. If text was already
+    streamed, the retry carries it as an assistant prefill (LLM_PREFILL_MODE)
+    and the continuation is stitched under the first stream's id, so callers
+    see a single stream. Partial tool calls cannot be continued and re-raise.
+    """
+    prefill_mode = settings.llm_prefill_mode.lower()
+    partial_parts: list[str] = []
+    has_tool_calls = False
+    stream_id = None
+    payload = payload_to_call
+    attempt = recovered = 0
+
+    while True:
+        try:
+            async with aclosing(create_streaming_response(base_url, api_key, deadlines, **payload)) as stream:
+                async for chunk in stream:
+                    if isinstance(chunk, dict):
+                        if stream_id is None:
+                            stream_id = chunk.get("id")
+                        else:
+                            chunk["id"] = stream_id
+
+                        for choice in chunk.get("choices") or []:
+                            delta = choice.get("delta") or {}
+
+                            if delta.get("content"):
+                                partial_parts.append(delta["content"])
+
+                            if delta.get("tool_calls"):
+                                has_tool_calls = True
+
+                    yield chunk
+
+            return
+
+        except Exception as e:
+            attempt += 1
+            resumable = not has_tool_calls and (not partial_parts or prefill_mode != "none")
+
+            if attempt > settings.upstream_max_retries or not resumable or not is_retryable(e):
+                raise
+
+            delay = settings.upstream_retry_backoff_seconds * 2 ** (attempt - 1)
+            logger.warning(f"Upstream stream failed ({e!r}), retry {attempt} in {delay:.1f}s with {len(partial_parts)} chunks recovered")
+
+            metrics.inc("upstream_retries")
+            # a content delta carries roughly one token
+            metrics.inc("upstream_recovered_tokens", len(partial_parts) - recovered)
+            recovered = len(partial_parts)
+
+            await asyncio.sleep(delay)
+
+            if partial_parts:
+                payload = continuation_payload(payload_to_call, "".join(partial_parts), prefill_mode)
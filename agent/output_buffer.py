@@ -0,0 +1,137 @@
+from collections import deque
+from typing import Iterator, Optional
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_ID_PATTERN = re.compile(r"[0-9a-f]{8,64}")
+
+class OutputBuffer:
+    """
+    Command output kept in bounded memory.
+
+    The first `head_limit` and last `tail_limit` characters stay in memory.
+    Once the output outgrows both, everything is also streamed to a spill
+    file named after `output_id`, which `read_spilled` can page through.
+    """
+
+    def __init__(self, output_id: str, spill_dir: str, head_limit: int, tail_limit: int):
+        self.output_id = output_id
+        self.spill_path = os.path.join(spill_dir, f"{output_id}.log")
+        self.head_limit = head_limit
+        self.tail_limit = tail_limit
+        self.total = 0
+        self._head: list[str] = []
+        self._head_size = 0
+        self._tail: deque[str] = deque()
+        self._tail_size = 0
+        self._spill = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._spill is not None
+
+    def _open_spill(self) -> None:
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        self._spill = open(self.spill_path, 'w', encoding='utf-8')
+
+        # nothing was dropped yet, so head and tail are all the output so far
+        self._spill.writelines(self._head)
+        self._spill.writelines(self._tail)
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+
+        self.total += len(text)
+
+        if self.spilled:
+            self._spill.write(text)
+
+        if self._head_size < self.head_limit:
+            room = self.head_limit - self._head_size
+            self._head.append(text[:room])
+            self._head_size += min(len(text), room)
+            text = text[room:]
+
+            if not text:
+                return
+
+        self._tail.append(text)
+        self._tail_size += len(text)
+
+        if self._tail_size > self.tail_limit and not self.spilled:
+            self._open_spill()
+
+        while self._tail_size > self.tail_limit:
+            excess = self._tail_size - self.tail_limit
+            first = self._tail.popleft()
+            self._tail_size -= len(first)
+
+            if len(first) > excess:
+                self._tail.appendleft(first[excess:])
+                self._tail_size += len(first) - excess
+
+    def close(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
+
+    def render(self) -> str:
+        head, tail = ''.join(self._head), ''.join(self._tail)
+
+        if not self.spilled:
+            return head + tail
+
+        omitted = self.total - len(head) - len(tail)
+        return (
+            f"{head}\n"
+            f"... [{omitted} characters omitted; the full output ({self.total} characters) "
+            f"was saved, page or grep it with read_output(output_id=\"{self.output_id}\")] ...\n"
+            f"{tail}"
+        )
+
+def prune_spills(spill_dir: str, keep: int) -> None:
+    """Removes all but the `keep` most recent spill files."""
+    try:
+        entries = [e for e in os.scandir(spill_dir) if e.name.endswith('.log')]
+
+    except FileNotFoundError:
+        return
+
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+
+        except OSError as e:
+            logger.warning(f"Could not remove spill file {entry.path}: {e}")
+
+def spill_path(spill_dir: str, output_id: str) -> Optional[str]:
+    if not OUTPUT_ID_PATTERN.fullmatch(output_id):
+        return None
+
+    path = os.path.join(spill_dir, f"{output_id}.log")
+    return path if os.path.exists(path) else None
+
+def read_spilled(path: str, offset: int, limit: int, pattern: Optional[re.Pattern] = None) -> Iterator[tuple[int, str]]:
+    """
+    Numbered lines of a spill file, streamed from disk: `limit` lines from
+    line `offset`, or, with `pattern`, the first `limit` matching lines
+    from there.
+    """
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for number, line in enumerate(f, start=1):
+            if number <= offset:
+                continue
+
+            if pattern is not None and not pattern.search(line):
+                continue
+
+            yield number, line.rstrip('\n')
+            limit -= 1
+
+            if limit <= 0:
+                break
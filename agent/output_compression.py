@@ -0,0 +1,131 @@
+from typing import Any, Optional
+import re
+
+# runs shorter than this are left alone
+MIN_RUN = 4
+# tool results shorter than this are not worth compressing
+MIN_CHARS = 1024
+# only command output is compressed; file, attachment and spilled output
+# reads must come back exactly as stored
+COMPRESSED_TOOLS = frozenset({"execute_command", "execute_commands"})
+
+_VARIABLE = re.compile(r'0x[0-9a-fA-F]+|\b[0-9a-fA-F]{7,}\b|\d+')
+_ERROR = re.compile(r'error|exception|fail|fatal|panic|traceback|denied|not found', re.IGNORECASE)
+_FRAME = re.compile(r'^\s+(File "|at |\.\.\. \d+ more)')
+
+def line_template(line: str) -> Optional[str]:
+    """
+    Key under which consecutive lines collapse: the line with its numbers
+    and hashes masked. Error lines have no key and are always kept.
+    """
+    if _ERROR.search(line):
+        return None
+
+    return _VARIABLE.sub('#', line.rstrip())
+
+def _stack_trace_end(lines: list[str], start: int) -> int:
+    # an indented block right after `start` with at least two frames
+    if lines[start][:1] in (' ', '\t'):
+        return start + 1
+
+    end, frames = start + 1, 0
+
+    while end < len(lines) and lines[end][:1] in (' ', '\t'):
+        frames += bool(_FRAME.match(lines[end]))
+        end += 1
+
+    return end if frames >= 2 else start + 1
+
+def _collapse_runs(lines: list[str]) -> list[str]:
+    out = []
+    keys = [line_template(line) for line in lines]
+    i = 0
+
+    while i < len(lines):
+        key = keys[i]
+        j = i + 1
+
+        if key is not None:
+            while j < len(lines) and keys[j] == key:
+                j += 1
+
+        if j - i >= MIN_RUN:
+            out.append(lines[i])
+            out.append(f"... [{j - i - 2} more similar lines] ...")
+            out.append(lines[j - 1])
+        else:
+            out.extend(lines[i:j])
+
+        i = j
+
+    return out
+
+def _dedupe_stack_traces(lines: list[str]) -> list[str]:
+    out = []
+    seen: dict[str, int] = {}
+    i = 0
+
+    while i < len(lines):
+        end = _stack_trace_end(lines, i)
+
+        if end - i <= 1:
+            out.append(lines[i])
+            i += 1
+            continue
+
+        trace = '\n'.join(lines[i + 1:end])
+
+        # the header line carries the message, it is always kept
+        out.append(lines[i])
+
+        if trace in seen:
+            out.append(f"    [same {end - i - 1}-line stack trace as #{seen[trace]} above]")
+        else:
+            seen[trace] = len(seen) + 1
+            out.extend(lines[i + 1:end])
+
+        i = end
+
+    return out
+
+def compress_output(text: str) -> str:
+    """
+    Deterministically shortens repetitive tool output: repeated stack
+    traces are replaced by a reference to their first occurrence, and runs
+    of lines that differ only in numbers or hashes are collapsed into the
+    first and last line plus a count. Error lines are kept verbatim.
+    """
+    if len(text) < MIN_CHARS:
+        return text
+
+    lines = text.split('\n')
+    compressed = '\n'.join(_collapse_runs(_dedupe_stack_traces(lines)))
+    return compressed if len(compressed) < len(text) else text
+
+def compress_tool_result(content: Any, tool_name: Optional[str] = None) -> tuple[Any, int]:
+    """
+    Compresses every text part of a refined MCP result of `tool_name`.
+    Returns the new content and the number of characters saved.
+    """
+    if tool_name is not None and tool_name not in COMPRESSED_TOOLS:
+        return content, 0
+
+    if isinstance(content, str):
+        compressed = compress_output(content)
+        return compressed, len(content) - len(compressed)
+
+    if isinstance(content, list):
+        saved, parts = 0, []
+
+        for part in content:
+            part, n = compress_tool_result(part)
+            parts.append(part)
+            saved += n
+
+        return parts, saved
+
+    if isinstance(content, dict) and isinstance(content.get("text"), str):
+        text, saved = compress_tool_result(content["text"])
+        return {**content, "text": text}, saved
+
+    return content, 0
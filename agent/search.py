@@ -0,0 +1,191 @@
+from collections import OrderedDict
+from typing import Any, Optional
+import asyncio
+import httpx
+import json
+import logging
+import time
+
+from .configs import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SNIPPET_LENGTH = 500
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+def _find_results(payload: Any, depth: int = 0) -> Optional[dict]:
+    # the proxy may wrap the search response, possibly as a JSON string
+    if depth > 6:
+        return None
+
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return None
+
+    if isinstance(payload, dict):
+        if isinstance(payload.get("results"), list):
+            return payload
+
+        values = payload.values()
+
+    elif isinstance(payload, list):
+        values = payload
+
+    else:
+        return None
+
+    for value in values:
+        found = _find_results(value, depth + 1)
+
+        if found is not None:
+            return found
+
+    return None
+
+def format_results(payload: Any) -> str:
+    """Compact text rendering of a search response."""
+    found = _find_results(payload)
+
+    if found is None:
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        return text[:4 * SNIPPET_LENGTH]
+
+    lines = []
+
+    if found.get("answer"):
+        lines.append(f"Answer: {found['answer']}\n")
+
+    for i, result in enumerate(found["results"], start=1):
+        snippet = ' '.join(str(result.get("content") or '').split())
+
+        if len(snippet) > SNIPPET_LENGTH:
+            snippet = snippet[:SNIPPET_LENGTH].rsplit(' ', 1)[0] + ' ...'
+
+        lines.append(f"{i}. {result.get('title') or 'Untitled'}\n   {result.get('url', '')}\n   {snippet}")
+
+    images = [
+        image if isinstance(image, dict) else {"url": image}
+        for image in found.get("images") or []
+    ]
+
+    if images:
+        lines.append("\nImages:")
+        lines.extend(
+            f"- {image.get('description') or 'image'}: {image.get('url', '')}"
+            for image in images
+        )
+
+    return '\n'.join(lines) if lines else "No results"
+
+class SearchClient:
+    """
+    Internet search through the MCP proxy over a pooled HTTP client.
+
+    Results are cached per normalized query for `ttl` seconds, and
+    concurrent identical queries share a single upstream request.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, timeout: float):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8)
+            )
+
+        return self._client
+
+    async def _fetch(self, query: str) -> str:
+        if not settings.search_proxy_url:
+            raise RuntimeError("ETERNALAI_MCP_PROXY_URL is not set")
+
+        body = {
+            "url": "https://api.tavily.com/search",
+            "headers": {
+                "Content-Type": "application/json",
+            },
+            "body": {
+                "query": query,
+                "max_results": 5,
+                "include_image_descriptions": True,
+                "include_images": True,
+                "search_depth": "advanced",
+                "topic": "general"
+            },
+            "method": "POST"
+        }
+
+        started_at = time.time()
+        response = await self._get_client().post(
+            settings.search_proxy_url,
+            json={'messages': [{'role': 'user', 'content': json.dumps(body)}]}
+        )
+        response.raise_for_status()
+        metrics.observe("search_upstream_seconds", time.time() - started_at)
+
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = response.text
+
+        return format_results(payload)
+
+    async def _fetch_and_cache(self, key: str, query: str) -> str:
+        try:
+            result = await self._fetch(query)
+            self._cache[key] = (time.time(), result)
+            self._cache.move_to_end(key)
+
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+            return result
+
+        finally:
+            self._inflight.pop(key, None)
+
+    async def search(self, query: str) -> str:
+        key = normalize_query(query)
+        cached = self._cache.get(key)
+
+        if cached is not None and time.time() - cached[0] < self.ttl:
+            metrics.inc("search_cache_hits")
+            self._cache.move_to_end(key)
+            return cached[1]
+
+        task = self._inflight.get(key)
+
+        if task is None:
+            metrics.inc("search_upstream_requests")
+            task = asyncio.create_task(self._fetch_and_cache(key, query))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+
+        else:
+            metrics.inc("search_coalesced")
+
+        # shielded, so one cancelled caller does not fail the others
+        return await asyncio.shield(task)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+search_client = SearchClient(
+    ttl=settings.search_cache_ttl_seconds,
+    max_entries=settings.search_cache_max_entries,
+    timeout=settings.search_timeout
+)
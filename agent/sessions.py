@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Optional
+import asyncio
+import logging
+import time
+
+from .configs import settings
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ChatSession:
+    session_id: str
+    messages: list[dict[str, Any]] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    # (number of messages, digest) of the last prompt sent upstream
+    prompt_digest: Optional[tuple[int, str]] = field(default=None, repr=False)
+
+class SessionStore:
+    """
+    Bounded in-memory store of refined /prompt conversations.
+
+    Entries expire `ttl_seconds` after their last access; when the store is
+    full the least recently used session is evicted.
+    """
+
+    def __init__(self, max_sessions: int, ttl_seconds: float, max_messages: int):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._sessions: OrderedDict[str, ChatSession] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _expired(self, session: ChatSession, now: float) -> bool:
+        return now - session.last_access > self.ttl_seconds
+
+    def _evict(self, now: float) -> None:
+        for session_id in [k for k, v in self._sessions.items() if self._expired(v, now)]:
+            logger.info(f"Session {session_id} expired")
+            del self._sessions[session_id]
+
+        while len(self._sessions) > self.max_sessions:
+            session_id, _ = self._sessions.popitem(last=False)
+            logger.info(f"Session {session_id} evicted")
+
+    def peek(self, session_id: str) -> Optional[ChatSession]:
+        session = self._sessions.get(session_id)
+
+        if session is None or self._expired(session, time.time()):
+            return None
+
+        return session
+
+    def get_or_create(self, session_id: str) -> ChatSession:
+        now = time.time()
+        self._evict(now)
+
+        session = self._sessions.get(session_id)
+
+        if session is None:
+            session = ChatSession(session_id=session_id)
+            self._sessions[session_id] = session
+
+        self._sessions.move_to_end(session_id)
+        session.last_access = now
+        self._evict(now)
+
+        return session
+
+    def save(self, session: ChatSession, messages: list[dict[str, Any]]) -> None:
+        if len(messages) > self.max_messages:
+            # keep the system prompt, drop the oldest turns beyond the cap
+            head = messages[:1] if messages[0].get("role") == "system" else []
+            body = messages[len(messages) - self.max_messages + len(head):]
+
+            # a tool result must not lead the history without its assistant call
+            while body and body[0].get("role") == "tool":
+                body.pop(0)
+
+            messages = head + body
+
+        session.messages = messages
+        session.last_access = time.time()
+
+        if session.session_id not in self._sessions:
+            self._sessions[session.session_id] = session
+
+        self._evict(session.last_access)
+
+    def drop(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+session_store = SessionStore(
+    max_sessions=settings.session_max_entries,
+    ttl_seconds=settings.session_ttl_seconds,
+    max_messages=settings.session_max_messages,
+)
@@ -0,0 +1,406 @@
+from collections import deque
+from contextlib import asynccontextmanager, suppress
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Optional
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sys
+import time
+
+from .configs import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCREEN_SESSION = "xterm"
+LOG_FILE = "/tmp/xterm.log"
+
+STUFF_CHUNK_SIZE = 512
+WATCHERS_TTL = 5.0
+
+class ScreenChannel:
+    """
+    Non-blocking control channel to one screen session.
+
+    Every screen command runs as an async subprocess, so the event loop never
+    waits on a fork. Concurrent `send` calls are coalesced into as few
+    `stuff` commands as possible.
+    """
+
+    def __init__(self, session_name: str):
+        self.session_name = session_name
+        self.forks = 0
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._watchers: tuple[float, bool] = (0.0, False)
+
+    async def _exec(self, *args: str, capture: bool = False) -> tuple[int, bytes]:
+        self.forks += 1
+        metrics.inc("terminal_forks")
+
+        process = await asyncio.create_subprocess_exec(
+            "screen", *args,
+            stdout=asyncio.subprocess.PIPE if capture else sys.stderr,
+            stderr=asyncio.subprocess.DEVNULL if capture else sys.stderr,
+            env=dict(os.environ)
+        )
+        out, _ = await process.communicate()
+        return process.returncode, out or b''
+
+    async def command(self, *args: str) -> int:
+        code, _ = await self._exec("-S", self.session_name, *args)
+        return code
+
+    async def _flush(self) -> None:
+        while self._pending:
+            batch, self._pending = self._pending, []
+            data = "".join(text for text, _ in batch)
+
+            try:
+                for i in range(0, len(data), STUFF_CHUNK_SIZE):
+                    code = await self.command("-X", "stuff", data[i:i + STUFF_CHUNK_SIZE])
+
+                    if code != 0:
+                        # e.g. the session is gone; fail now rather than wait for output
+                        raise RuntimeError(f"screen could not type into session {self.session_name} (exit code {code})")
+
+            except Exception as e:
+                for _, waiter in batch:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+
+            else:
+                for _, waiter in batch:
+                    if not waiter.done():
+                        waiter.set_result(None)
+
+    async def send(self, text: str) -> None:
+        """Type `text` into the session, returning once it was delivered."""
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending.append((text, waiter))
+
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+        await waiter
+
+    async def has_watchers(self) -> bool:
+        # ttyd viewers attach to the session with `screen -x`; cached briefly
+        checked_at, attached = self._watchers
+
+        if time.time() - checked_at > WATCHERS_TTL:
+            _, out = await self._exec("-ls", self.session_name, capture=True)
+            attached = b"(Attached)" in out
+            self._watchers = (time.time(), attached)
+
+        return attached
+
+@dataclass
+class TerminalSession:
+    name: str
+    log_file: str
+    owner: Optional[str] = field(default=None)
+    last_release: float = field(default=0.0)
+    pid_file: Optional[str] = field(default=None)
+    # unique per lease, tells anonymous leases of the same session apart
+    lease_id: Optional[str] = field(default=None)
+    channel: ScreenChannel = field(init=False, repr=False)
+    _shell_pid: Optional[int] = field(default=None, init=False, repr=False)
+    # held while a command line is typed and submitted, so nothing else is typed in between
+    typing: asyncio.Lock = field(default_factory=asyncio.Lock, init=False, repr=False)
+
+    def __post_init__(self):
+        self.channel = ScreenChannel(self.name)
+
+    @property
+    def owner_key(self) -> str:
+        """Key of what the current lease owns, e.g. its background jobs."""
+        return self.owner if self.owner is not None else f"{self.name}/{self.lease_id}"
+
+    @property
+    def shell_pid(self) -> Optional[int]:
+        # written by the shell itself at spawn, see TerminalPool._spawn
+        if self._shell_pid is None and self.pid_file is not None:
+            with suppress(OSError, ValueError):
+                with open(self.pid_file) as f:
+                    self._shell_pid = int(f.read().strip())
+
+        return self._shell_pid
+
+    def foreground_pgid(self) -> Optional[int]:
+        """Process group in the foreground of the session's terminal."""
+        if self.shell_pid is None:
+            return None
+
+        try:
+            with open(f"/proc/{self.shell_pid}/stat") as f:
+                stat = f.read()
+
+        except OSError:
+            return None
+
+        # fields after the parenthesised command name: state ppid pgrp session tty_nr tpgid
+        pgid = int(stat.rsplit(')', 1)[1].split()[5])
+        return pgid if pgid > 0 else None
+
+    def cwd(self) -> Optional[str]:
+        """Working directory of the session's shell, if known."""
+        if self.shell_pid is None:
+            return None
+
+        try:
+            return os.readlink(f"/proc/{self.shell_pid}/cwd")
+
+        except OSError:
+            return None
+
+    def is_alive(self) -> bool:
+        """Whether the session's shell still runs; unknown counts as alive."""
+        return self.shell_pid is None or os.path.exists(f"/proc/{self.shell_pid}")
+
+    def is_busy(self) -> bool:
+        pgid = self.foreground_pgid()
+        return pgid is not None and pgid != self.shell_pid
+
+# the legacy shared session, used when no terminal is leased
+DEFAULT_TERMINAL = TerminalSession(name=SCREEN_SESSION, log_file=LOG_FILE, pid_file="/tmp/xterm.pid")
+
+current_terminal: ContextVar[TerminalSession] = ContextVar("current_terminal", default=DEFAULT_TERMINAL)
+
+class TerminalPool:
+    """
+    Pre-spawned screen sessions, each with its own log file.
+
+    A session is leased to one request for its whole lifetime, so concurrent
+    requests never type into (or read from) the same terminal. Leases prefer
+    the session last used by the same owner to keep its working directory.
+    """
+
+    def __init__(self, size: int, prefix: str = SCREEN_SESSION, log_dir: str = "/tmp"):
+        self.size = size
+        self.prefix = prefix
+        self.log_dir = log_dir
+        self._idle: list[TerminalSession] = []
+        self._all: list[TerminalSession] = []
+        self._waiters: deque[asyncio.Future] = deque()
+        self._starting = asyncio.Lock()
+
+    async def _spawn(self, name: str) -> TerminalSession:
+        session = TerminalSession(
+            name=name,
+            log_file=os.path.join(self.log_dir, f"{name}.log"),
+            pid_file=os.path.join(self.log_dir, f"{name}.pid")
+        )
+
+        await self._launch(session)
+        return session
+
+    async def _launch(self, session: TerminalSession) -> None:
+        with open(session.log_file, 'w') as f:
+            f.write('')
+
+        if session.pid_file is not None:
+            with suppress(FileNotFoundError):
+                os.remove(session.pid_file)
+
+        session._shell_pid = None
+
+        code, _ = await session.channel._exec("-dmS", session.name, "-s", "bash")
+
+        if code != 0:
+            raise RuntimeError(f"screen exited with code {code}")
+
+        for call in [
+            ["-X", "logfile", session.log_file],
+            ["-X", "log", "on"],
+            # write through, so output reaches the log the moment it is printed
+            ["-X", "logfile", "flush", "0"],
+        ]:
+            await session.channel.command(*call)
+
+        await session.channel.send(f"echo $$ > {session.pid_file}; history -c && clear\n")
+
+        logger.info(f"Terminal session {session.name} started, logging to {session.log_file}")
+
+    async def start(self) -> None:
+        self._all = []
+
+        if self.size > 0:
+            results = await asyncio.gather(*[
+                self._spawn(f"{self.prefix}-{i}")
+                for i in range(self.size)
+            ], return_exceptions=True)
+
+            for i, result in enumerate(results):
+                if isinstance(result, TerminalSession):
+                    self._all.append(result)
+
+                elif isinstance(result, Exception):
+                    logger.error(f"Failed to start terminal session {self.prefix}-{i}: {result!r}")
+
+                else:
+                    raise result
+
+            if len(self._all) < self.size:
+                logger.warning(f"Terminal pool started with {len(self._all)} of {self.size} sessions")
+
+        if not self._all:
+            # no pool, everything shares the legacy session
+            try:
+                await self._launch(DEFAULT_TERMINAL)
+
+            except Exception as e:
+                raise RuntimeError(f"No terminal session could be started: {e!r}") from e
+
+            self._all = [DEFAULT_TERMINAL]
+
+        self._idle = list(self._all)
+        metrics.set("terminal_pool_size", len(self._all))
+        metrics.set("terminal_pool_idle", len(self._idle))
+
+    async def stop(self) -> None:
+        for session in self._all:
+            await session.channel.command("-X", "quit")
+
+        self._idle, self._all = [], []
+
+    def _pick(self, owner: Optional[str]) -> TerminalSession:
+        for session in self._idle:
+            if owner is not None and session.owner == owner:
+                return session
+
+        return min(self._idle, key=lambda e: e.last_release)
+
+    async def _recycle(self, session: TerminalSession) -> None:
+        # a fresh shell, so nothing the previous owner exported, defined or
+        # left running carries over; the hangup stops the shell's jobs too
+        await session.channel.command("-X", "quit")
+        await self._launch(session)
+        metrics.inc("terminal_sessions_respawned")
+
+    def _wake_next(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def _acquire(self, owner: Optional[str]) -> TerminalSession:
+        while not self._idle:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+
+            try:
+                await waiter
+
+            except asyncio.CancelledError:
+                # hand a wakeup we can no longer use to the next waiter
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next()
+
+                raise
+
+        session = self._pick(owner)
+        self._idle.remove(session)
+        metrics.set("terminal_pool_idle", len(self._idle))
+        return session
+
+    def _release(self, session: TerminalSession) -> None:
+        # synchronous, so a cancelled request can never leak its terminal
+        session.last_release = time.time()
+        self._idle.append(session)
+        metrics.set("terminal_pool_idle", len(self._idle))
+        self._wake_next()
+
+    @asynccontextmanager
+    async def lease(self, owner: Optional[str] = None) -> AsyncGenerator[TerminalSession, None]:
+        async with self._starting:
+            if not self._all:
+                await self.start()
+
+        enqueued = time.time()
+        session = await self._acquire(owner)
+        metrics.observe("terminal_lease_wait_seconds", time.time() - enqueued)
+
+        previous = current_terminal.get()
+
+        try:
+            # anonymous requests never share state, so they always start clean;
+            # a shell that exited is replaced whoever leases it
+            if (owner is None or session.owner != owner or not session.is_alive()):
+                await self._recycle(session)
+
+            session.owner = owner
+            session.lease_id = secrets.token_hex(4)
+            current_terminal.set(session)
+            yield session
+
+        finally:
+            current_terminal.set(previous)
+            self._release(session)
+
+async def interrupt_terminal(session: TerminalSession, timeout: float) -> None:
+    """
+    Sends Ctrl-C to the session. Runs as its own task so that it still
+    happens when the caller is being cancelled.
+    """
+    task = asyncio.ensure_future(
+        asyncio.wait_for(session.channel.send("\x03"), timeout=timeout)
+    )
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    try:
+        await asyncio.shield(task)
+
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out interrupting {session.name}")
+
+    except Exception as e:
+        # must not replace the cancellation that is being handled
+        logger.warning(f"Failed to interrupt {session.name}: {e!r}")
+
+async def terminate_foreground(session: TerminalSession, grace: float) -> bool:
+    """
+    Stops whatever runs in the session's foreground: Ctrl-C first, then
+    SIGTERM and SIGKILL to its process group, waiting `grace` seconds after
+    each step. Returns whether the shell got its terminal back.
+    """
+    async def wait_idle() -> bool:
+        deadline = time.time() + grace
+
+        while session.is_busy():
+            if time.time() > deadline:
+                return False
+
+            await asyncio.sleep(0.1)
+
+        return True
+
+    await interrupt_terminal(session, timeout=grace)
+
+    if await wait_idle():
+        return True
+
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        pgid = session.foreground_pgid()
+
+        if pgid is None or pgid == session.shell_pid:
+            return True
+
+        logger.warning(f"Sending {sig.name} to process group {pgid} of {session.name}")
+        metrics.inc("terminal_process_group_kills")
+
+        with suppress(ProcessLookupError):
+            os.killpg(pgid, sig)
+
+        if await wait_idle():
+            return True
+
+    return False
+
+terminal_pool = TerminalPool(size=settings.terminal_pool_size)
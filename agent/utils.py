@@ -4,7 +4,11 @@ from mcp.types import CallToolResult, TextContent, Tool, EmbeddedResource
 from pydantic import BaseModel
 from mcp.server.fastmcp import FastMCP
 import re
+import json
+import hashlib
 import datetime
+from .configs import settings
+from .attachments import attachment_store, AttachmentError
 
 logger = logging.getLogger(__name__)
 T = TypeVar('T')
@@ -169,11 +173,105 @@ def strip_thinking_content(content: str) -> str:
     return pat.sub("", content).lstrip()
 
 
+def refine_file_part(file: dict[str, Any]) -> str:
+    """
+    Stores a file content part and returns its reference for the prompt.
+    A part without data may reference an earlier attachment by file_id
+    "sha256:<digest>".
+    """
+    try:
+        if file.get('file_data'):
+            attachment = attachment_store.ingest(file['file_data'], filename=file.get('filename'))
+        else:
+            attachment = attachment_store.get(file.get('file_id') or '')
+
+    except AttachmentError as e:
+        logger.warning(f"Dropping attachment {file.get('filename')!r}: {e}")
+        return f"{file.get('filename') or 'attachment'} (could not be stored: {e})"
+
+    if attachment is None:
+        return f"{file.get('filename') or file.get('file_id') or 'attachment'} (unknown attachment)"
+
+    return attachment.reference
+
+def refine_message(message: dict[str, Any]) -> dict[str, str]:
+    if isinstance(message, dict) \
+        and message.get('role', 'undefined') == 'user' \
+        and isinstance(message.get('content'), list):
+
+        content = message['content']
+        text_input = ''
+        attachments = []
+
+        for item in content:
+            if item.get('type', 'undefined') == 'text':
+                text_input += item.get('text') or ''
+
+            elif item.get('type', 'undefined') == 'file':
+                attachments.append(refine_file_part(item.get('file') or {}))
+
+        if attachments:
+            text_input += '\nAttachments:\n'
+
+            for attachment in attachments:
+                text_input += f'- {attachment}\n'
+
+        return {
+            "role": "user",
+            "content": text_input
+        }
+
+    return {
+        "role": message.get('role', 'assistant'),
+        "content": strip_toolcall_noti(strip_thinking_content(message.get("content", "")))
+    }
+
+
+_TIME_FORMATS = {
+    "second": "%Y-%m-%d %H:%M:%S",
+    "minute": "%Y-%m-%d %H:%M",
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+}
+
+def current_time_str() -> str:
+    # coarser granularity keeps the text, and so the prompt, stable for longer
+    fmt = _TIME_FORMATS.get(settings.prompt_time_granularity, _TIME_FORMATS["minute"])
+    return datetime.datetime.now(tz=datetime.timezone.utc).strftime(fmt)
+
+def inject_current_time(messages: list[dict[str, Any]], start: int = 0) -> list[dict[str, Any]]:
+    """
+    Appends the current time to the latest user turn from `start` on (the
+    messages of the current request), when configured to place it there
+    instead of in the system prompt. Earlier turns are left untouched, so
+    the prompt prefix stays byte-identical across turns.
+    """
+    if settings.prompt_time_placement != "user":
+        return messages
+
+    for i in range(len(messages) - 1, start - 1, -1):
+        message = messages[i]
+
+        if message.get('role') == 'user' and isinstance(message.get('content'), str):
+            # a copy, the dict may be shared with the stored history
+            messages[i] = {
+                **message,
+                'content': message['content'] + f'\n\n(Current time: {current_time_str()} UTC; only use this when being asked or for searching purposes)'
+            }
+            break
+
+    return messages
+
+def messages_digest(messages: list[dict[str, Any]]) -> str:
+    """Digest of the messages exactly as they are serialized to the upstream."""
+    serialized = json.dumps(messages, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
 def refine_chat_history(messages: list[dict[str, str]], system_prompt: str) -> list[dict[str, str]]:
     refined_messages = []
 
-    current_time_utc_str = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-    system_prompt += f'\nNote: Current time is {current_time_utc_str} UTC (only use this information when being asked or for searching purposes)'
+    if settings.prompt_time_placement == "system":
+        system_prompt += f'\nNote: Current time is {current_time_str()} UTC (only use this information when being asked or for searching purposes)'
 
     has_system_prompt = False
     for message in messages:
@@ -184,40 +282,8 @@ def refine_chat_history(messages: list[dict[str, str]], system_prompt: str) -> l
             has_system_prompt = True
             refined_messages.append(message)
             continue
-    
-        if isinstance(message, dict) \
-            and message.get('role', 'undefined') == 'user' \
-            and isinstance(message.get('content'), list):
-
-            content = message['content']
-            text_input = ''
-            attachments = []
-
-            for item in content:
-                if item.get('type', 'undefined') == 'text':
-                    text_input += item.get('text') or ''
-
-                elif item.get('type', 'undefined') == 'file':
-                    pass
-
-            if attachments:
-                text_input += '\nAttachments:\n'
-
-                for attachment in attachments:
-                    text_input += f'- {attachment}\n'
-
-            refined_messages.append({
-                "role": "user",
-                "content": text_input
-            })
-
-        else:
-            _message = {
-                "role": message.get('role', 'assistant'),
-                "content": strip_toolcall_noti(strip_thinking_content(message.get("content", "")))
-            }
 
-            refined_messages.append(_message)
+        refined_messages.append(refine_message(message))
 
     if not has_system_prompt and system_prompt != "":
         refined_messages.insert(0, {
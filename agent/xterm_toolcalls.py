@@ -1,23 +1,33 @@
 from mcp.server.fastmcp import FastMCP
 import os
-import sys
-import subprocess
 from typing import Dict, Optional, AsyncGenerator
 import random
 import re
 import json
 import shlex
+import secrets
 from dataclasses import dataclass, field
 from datetime import datetime
 import asyncio
+import httpx
 import logging
+import time
+from .terminal import current_terminal, TerminalSession, terminate_foreground
+from .log_watch import LogWatcher
+from .fileops import write_atomic, read_lines, read_bytes, is_binary, search_replace, apply_unified_diff, PatchError
+from .search import search_client
+from .jobs import job_manager
+from .attachments import attachment_store, AttachmentError
+from .output_buffer import OutputBuffer, prune_spills, spill_path, read_spilled
+from .configs import settings
+from .metrics import metrics
 
 mcp = FastMCP("terminal-controller")
 logger = logging.getLogger(__name__)
 
-SCREEN_SESSION = "xterm"
-LOG_FILE = "/tmp/xterm.log"
-DEFAULT_TIMEOUT = 300
+DEFAULT_TIMEOUT = settings.terminal_command_timeout
+# longest a tool waits for its summary line to be typed into the terminal
+ANNOUNCE_TIMEOUT = 2.0
 
 @dataclass
 class AIResponse:
@@ -26,6 +36,8 @@ class AIResponse:
     return_code: int = field(default=-1)
     duration: str = field(default='')
     command: str = field(default='')
+    timed_out: bool = field(default=False)
+    output_id: Optional[str] = field(default=None)
     
     def to_dict(self) -> Dict:
         return {
@@ -33,16 +45,14 @@ class AIResponse:
             "output": self.output,
             "return_code": self.return_code,
             "duration": self.duration,
-            "command": self.command
+            "command": self.command,
+            "timed_out": self.timed_out,
+            "output_id": self.output_id
         }
 
 def wrap_stuff_command(cmd: str, safe=True) -> str:
     return cmd
 
-CURRENT_USER = os.environ['HOME'].split('/')[-1]
-CURRENT_HOST = os.environ['HOSTNAME']
-TERMINATOR = f"{CURRENT_USER}@{CURRENT_HOST}"
-
 from string import punctuation
 
 async def random_batching(cmd: str, max_length: int = 10) -> AsyncGenerator[str, None]:
@@ -70,9 +80,209 @@ def remove_console_color(text):
   return re.sub(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])', '', text)
 
 
+class TerminalRenderer:
+    """
+    Streaming renderer for a VT100 subset.
+
+    Applies carriage returns, backspaces, tabs, cursor movement and line
+    erasure the way a terminal would, and emits only the final content of
+    each line, so redrawn progress bars collapse into their last state.
+    Lines stay editable while within `window` lines of the cursor, which is
+    enough for multi-line progress displays that move the cursor up.
+    Colors and other escape sequences are dropped.
+    """
+
+    TOKEN = re.compile(
+        r'[^\x00-\x1f\x7f]+'                       # printable run
+        r'|\x1b\[([0-?]*)[ -/]*([@-~])'             # CSI
+        r'|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)'       # OSC, e.g. window titles
+        r'|\x1b[()][0-9A-Za-z]'                     # charset selection
+        r'|\x1b[ -/]*[0-~]'                         # other escapes
+        r'|[\r\n\b\t]'
+    )
+
+    # incomplete escape sequence at the end of a chunk
+    PARTIAL = re.compile(r'\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*\x1b?|[()]|[ -/]*)?$')
+
+    def __init__(self, window: int = 64, max_line: int = 8192):
+        self.window = window
+        self.max_line = max_line
+        self.lines: list[str] = ['']
+        self.row = 0
+        self.col = 0
+        self.saved = (0, 0)
+        self.fed = 0
+        self._partial = ''
+        # text appended to the current line, joined only when it is edited
+        self._parts: list[str] = []
+        self._parts_len = 0
+        self._final: list[str] = []
+
+    def _join(self) -> None:
+        if self._parts:
+            self.lines[self.row] += ''.join(self._parts)
+            self._parts, self._parts_len = [], 0
+
+    def _put(self, text: str) -> None:
+        if self.col == len(self.lines[self.row]) + self._parts_len:
+            self._parts.append(text)
+            self._parts_len += len(text)
+        else:
+            self._join()
+            line = self.lines[self.row]
+
+            if self.col == 0 and len(text) >= len(line):
+                line = text
+            elif self.col > len(line):
+                line += ' ' * (self.col - len(line)) + text
+            else:
+                line = line[:self.col] + text + line[self.col + len(text):]
+
+            self.lines[self.row] = line
+
+        self.col += len(text)
+
+        if len(self.lines[self.row]) + self._parts_len > self.max_line:
+            self._cut_line()
+
+    def _cut_line(self) -> None:
+        # a line without newlines (minified code, base64) would grow without
+        # bound; everything before the last half of it becomes final, along
+        # with the lines above, which the cursor can then no longer reach
+        self._join()
+        line = self.lines[self.row]
+        cut = len(line) - self.max_line // 2
+
+        self._final.extend(above.rstrip() + '\n' for above in self.lines[:self.row])
+        self._final.append(line[:cut])
+
+        self.saved = (max(self.saved[0] - self.row, 0), self.saved[1])
+        self.lines = [line[cut:]] + self.lines[self.row + 1:]
+        self.row = 0
+        self.col = max(self.col - cut, 0)
+
+    def _move_row(self, row: int) -> None:
+        self.row = max(row, 0)
+
+        while self.row >= len(self.lines):
+            self.lines.append('')
+
+    def _csi(self, params: str, final: str) -> None:
+        if final in 'ABEFJK':
+            # edits the line or leaves it; colors and column moves need no join
+            self._join()
+
+        args = [int(p) if p.isdigit() else 0 for p in params.lstrip('?').split(';')]
+        n = max(args[0], 1)
+
+        if final == 'A':
+            self._move_row(self.row - n)
+        elif final in 'BE':
+            self._move_row(self.row + n)
+        elif final == 'C':
+            self.col += n
+        elif final == 'D':
+            self.col = max(self.col - n, 0)
+        elif final == 'G':
+            self.col = n - 1
+        elif final in 'Hf':
+            # absolute rows are meaningless in a scrolled log, keep the column
+            self.col = max(args[1], 1) - 1 if len(args) > 1 else 0
+        elif final == 'K':
+            line = self.lines[self.row]
+
+            if args[0] == 0:
+                self.lines[self.row] = line[:self.col]
+            elif args[0] == 1:
+                self.lines[self.row] = ' ' * min(self.col + 1, len(line)) + line[self.col + 1:]
+            else:
+                self.lines[self.row] = ''
+        elif final == 'J' and args[0] == 0:
+            self.lines[self.row] = self.lines[self.row][:self.col]
+            del self.lines[self.row + 1:]
+
+        if final in 'EF':
+            self.col = 0
+
+    def _emit_scrolled(self) -> list[str]:
+        # lines far above the cursor can no longer change
+        done = len(self.lines) - self.window
+
+        if done <= 0 or self.row < done:
+            return []
+
+        emitted, self.lines = self.lines[:done], self.lines[done:]
+        self.row -= done
+        self.saved = (max(self.saved[0] - done, 0), self.saved[1])
+        return emitted
+
+    def feed(self, text: str) -> str:
+        """Renders `text`; returns the lines that became final, newline-terminated."""
+        self.fed += len(text)
+        text, self._partial = self._partial + text, ''
+        partial = self.PARTIAL.search(text)
+
+        if partial is not None and partial.start() < len(text):
+            text, self._partial = text[:partial.start()], text[partial.start():]
+
+        for token in self.TOKEN.finditer(text):
+            c = token.group()
+
+            if c[0] >= ' ':
+                self._put(c)
+            elif c == '\n':
+                self._join()
+                self._move_row(self.row + 1)
+                self.col = 0
+            elif c == '\r':
+                self.col = 0
+            elif c == '\b':
+                self.col = max(self.col - 1, 0)
+            elif c == '\t':
+                self.col = (self.col // 8 + 1) * 8
+            elif token.group(2) is not None:
+                self._csi(token.group(1), token.group(2))
+            elif c == '\x1b7':
+                self.saved = (self.row, self.col)
+            elif c == '\x1b8':
+                self._join()
+                self._move_row(self.saved[0])
+                self.col = self.saved[1]
+
+        final, self._final = ''.join(self._final), []
+        return final + ''.join(line.rstrip() + '\n' for line in self._emit_scrolled())
+
+    def flush(self) -> str:
+        """Emits every remaining line; the last one only if it has content."""
+        self._join()
+        lines, self.lines = self.lines, ['']
+        self.row = self.col = 0
+
+        if lines and not lines[-1].strip():
+            lines.pop()
+
+        final, self._final = ''.join(self._final), []
+        return final + ''.join(line.rstrip() + '\n' for line in lines)
+
+
+
+async def should_animate(session: TerminalSession) -> bool:
+    mode = settings.terminal_typing_mode.lower()
+
+    if mode == "auto":
+        return await session.channel.has_watchers()
+
+    return mode == "animated"
 
 async def type_command(cmd: str, fast=False) -> str:
-    
+    session = current_terminal.get()
+    started_at = time.time()
+
+    if not await should_animate(session):
+        await session.channel.send(cmd)
+        metrics.observe("terminal_type_seconds", time.time() - started_at)
+        return
+
     tokenized = []
     
     max_length = 10 if not fast else 30
@@ -81,56 +291,142 @@ async def type_command(cmd: str, fast=False) -> str:
         tokenized.append(batch)
 
     for i, c in enumerate(tokenized):
-        subprocess.check_call(
-            ["screen", "-S", SCREEN_SESSION, "-X", "stuff", c],
-            stdout=sys.stderr,
-            stderr=sys.stderr,
-            env=os.environ,
-        )
-
+        await session.channel.send(c)
         await asyncio.sleep(random.uniform(0.04, 0.15 if not fast else 0.08))
 
+    metrics.observe("terminal_type_seconds", time.time() - started_at)
+
 async def flush_command() -> str:
+    session = current_terminal.get()
+
     # clear the log file before flushing
-    with open(LOG_FILE, 'w') as f:
+    with open(session.log_file, 'w') as f:
         f.write('')
 
-    subprocess.check_call(["screen", "-S", SCREEN_SESSION, "-X", "stuff", '\n'])
+    await session.channel.send('\n')
     
-async def flush_log() -> str:
-    subprocess.check_call(["screen", "-S", SCREEN_SESSION, "-X", "colon", "logfile flush 1^M"])
+def announce(line: str) -> asyncio.Future:
+    """
+    Echoes `line` as a no-op command in the terminal, for whoever watches
+    it. Runs in the background and is skipped while something else holds
+    the foreground. The returned future settles once the line was typed,
+    skipped or given up on after ANNOUNCE_TIMEOUT seconds; it never raises.
+    """
+    session = current_terminal.get()
 
-async def capture_output() -> str:
-    OUTPUT_LENGTH_LIMIT = 40000
-    output = []
+    async def type_line() -> None:
+        try:
+            async with asyncio.timeout(ANNOUNCE_TIMEOUT):
+                # never between a command's text and the newline submitting it
+                async with session.typing:
+                    if not session.is_busy():
+                        await session.channel.send(f": {shlex.quote(line)}\n")
 
-    with open(LOG_FILE, 'rb') as f:
-        f.seek(0, 2)
+        except Exception as e:
+            logger.debug(f"Skipped announcing {line!r} in {session.name}: {e!r}")
 
+    return asyncio.ensure_future(type_line())
+
+def frame_command(cmd: str, token: str) -> str:
+    """
+    Wraps `cmd` between a start and an end sentinel, the latter carrying its
+    exit status. The sentinels are printed with printf, so the typed line
+    never contains them verbatim; `eval` keeps multi-line commands, comments
+    and trailing `&` intact.
+    """
+    return (
+        f"printf '__BEGIN_%s__\\n' {token}; "
+        f"eval {shlex.quote(cmd)}; "
+        f"printf '\\n__END_%s_%d__\\n' {token} $?"
+    )
+
+# an end marker may straddle two reads, so this much output is held back
+MARKER_HOLDBACK = 64
+
+async def capture_output(token: str, timeout: float = DEFAULT_TIMEOUT) -> tuple[OutputBuffer, int, bool]:
+    """
+    Output of the framed command `token`, its exit code and whether it timed
+    out. On timeout the command is stopped and the output so far returned.
+    """
+    session = current_terminal.get()
+    begin = re.compile(rf"__BEGIN_{token}__\r?\n")
+    end = re.compile(rf"\r?\n__END_{token}_(\d+)__")
+    deadline = time.time() + timeout
+    timed_out, started = False, False
+    pending = ''
+    renderer = TerminalRenderer()
+
+    output = OutputBuffer(
+        output_id=token,
+        spill_dir=settings.terminal_spill_dir,
+        head_limit=settings.terminal_output_head_chars,
+        tail_limit=settings.terminal_output_tail_chars
+    )
+
+    with LogWatcher(session.log_file) as watcher:
         while True:
-            line = f.readline()
+            try:
+                pending += await asyncio.wait_for(watcher.read(), timeout=max(deadline - time.time(), 0))
 
-            if not line:
-                await asyncio.sleep(.3)
-                # await flush_log()
-                continue
+            except asyncio.TimeoutError:
+                logger.warning(f"Command {token} timed out after {timeout}s, stopping it")
+                metrics.inc("terminal_commands_timed_out")
+                timed_out = True
+
+                await terminate_foreground(session, grace=settings.terminal_kill_grace_seconds)
+                pending += watcher.read_nowait()
+
+            if not started:
+                match = begin.search(pending)
+
+                if match is None:
+                    if timed_out:
+                        pending = ''
+                        break
+
+                    continue
 
-            line = line.decode('utf-8', errors='replace')
-            line = remove_console_color(line)
-            output.append(line.replace(TERMINATOR, ''))
+                pending = pending[match.end():]
+                started = True
 
-            if TERMINATOR in line:
+            match = end.search(pending)
+
+            if match is not None or timed_out:
                 break
 
-    total_length = 0
-    start_index = 0
-    for i in range(len(output)-1, -1, -1):        
-        start_index = i
-        total_length += len(output[i])
-        if total_length > OUTPUT_LENGTH_LIMIT:
-            break
+            # hand complete lines over, keeping what a marker could start in
+            if len(pending) <= MARKER_HOLDBACK:
+                continue
+
+            cut = pending.rfind('\n', 0, len(pending) - MARKER_HOLDBACK)
+
+            if cut < 0 and len(pending) > 2 * MARKER_HOLDBACK:
+                cut = len(pending) - MARKER_HOLDBACK - 1
+
+            if cut >= 0:
+                output.write(renderer.feed(pending[:cut + 1]))
+                pending = pending[cut + 1:]
+
+    metrics.observe("terminal_capture_wakeups", watcher.wakeups)
+
+    if match is None:
+        # interrupted before it could report its status
+        output.write(renderer.feed(pending))
+        return_code = -1
+    else:
+        output.write(renderer.feed(pending[:match.start()]))
+        return_code = int(match.group(1))
 
-    return '\n'.join(output[start_index:])
+    output.write(renderer.flush())
+    output.close()
+    metrics.observe("terminal_output_raw_chars", renderer.fed)
+    metrics.observe("terminal_output_chars", output.total)
+
+    if output.spilled:
+        metrics.inc("terminal_outputs_spilled")
+        prune_spills(settings.terminal_spill_dir, keep=settings.terminal_spill_max_files)
+
+    return output, return_code, timed_out
 
 
 async def run_command(cmd: str, timeout: int = DEFAULT_TIMEOUT, safe=False, fast=False) -> Dict:
@@ -146,19 +442,31 @@ async def run_command(cmd: str, timeout: int = DEFAULT_TIMEOUT, safe=False, fast
     """
     start_time = datetime.now()
     logger.info(f"Running command: {cmd}")
+    session = current_terminal.get()
+    channel = session.channel
+    forks_before = channel.forks
+    token = secrets.token_hex(8)
 
     try:
-        await type_command(wrap_stuff_command(cmd, safe=safe), fast=fast)
-        await flush_command()
+        async with session.typing:
+            await type_command(frame_command(wrap_stuff_command(cmd, safe=safe), token), fast=fast)
+            await flush_command()
 
-        output = await capture_output()
+        output, return_code, timed_out = await capture_output(token, timeout=timeout)
         duration = datetime.now() - start_time
+        metrics.observe("terminal_forks_per_command", channel.forks - forks_before)
+
+        if return_code != 0:
+            metrics.inc("terminal_commands_failed")
 
         result = AIResponse(
-            success=True,
-            output=output,
+            success=return_code == 0,
+            output=output.render(),
+            return_code=return_code,
             duration=str(duration),
-            command=cmd
+            command=cmd,
+            timed_out=timed_out,
+            output_id=output.output_id if output.spilled else None
         ).to_dict()
 
         return result
@@ -175,13 +483,14 @@ async def run_command(cmd: str, timeout: int = DEFAULT_TIMEOUT, safe=False, fast
 
 
 @mcp.tool()
-async def execute_command(command: str, filter_str: Optional[str] = None) -> str:
+async def execute_command(command: str, filter_str: Optional[str] = None, timeout: Optional[int] = None) -> str:
     """
     Execute command in a real terminal
 
     Args:
         command: Command line command to execute
         filter_str: Filter to apply to the command output
+        timeout: Seconds to wait before the command is interrupted (default 300)
     
     Returns:
         Output of the command execution
@@ -191,20 +500,253 @@ async def execute_command(command: str, filter_str: Optional[str] = None) -> str
         quoted_filter_str = shlex.quote(filter_str)
         command += f" | grep {quoted_filter_str}"
 
-    result = await run_command(command, safe=False)
+    result = await run_command(command, timeout=timeout or DEFAULT_TIMEOUT, safe=False)
 
-    status = 'successfully' if result["success"] else 'failed'
-    output = f"Command {status} executed\n\n"
+    if result["timed_out"]:
+        output = f"Command timed out after {timeout or DEFAULT_TIMEOUT:g}s and was interrupted\n\n"
+    else:
+        status = 'successfully' if result["success"] else 'failed'
+        output = f"Command {status} executed (exit code {result['return_code']})\n\n"
 
     if result["output"]:
         output += f"Output:\n{result['output']}"
 
     return output
 
+BATCH_OUTPUT_LIMIT = 4000
+
+def bound_output(output: str, limit: int = BATCH_OUTPUT_LIMIT) -> str:
+    # keep both ends, errors tend to be at the end and context at the start
+    if len(output) <= limit:
+        return output
+
+    head, tail = output[:limit // 4], output[-(limit - limit // 4):]
+    return f"{head}\n... [{len(output) - len(head) - len(tail)} characters omitted] ...\n{tail}"
+
+@mcp.tool()
+async def execute_commands(commands: list[str], stop_on_error: bool = True, timeout: Optional[int] = None) -> str:
+    """
+    Execute several commands one after another in the same terminal, in a single step
+
+    Args:
+        commands: Ordered list of command line commands
+        stop_on_error: Skip the remaining commands once one fails
+        timeout: Seconds each command may run before it is interrupted (default 300)
+
+    Returns:
+        Exit code and output of every command that ran
+    """
+
+    sections, ran, failed = [], 0, 0
+    metrics.observe("batch_commands", len(commands))
+
+    for i, command in enumerate(commands, start=1):
+        result = await run_command(command, timeout=timeout or DEFAULT_TIMEOUT, safe=False)
+        ran += 1
+
+        if result["timed_out"]:
+            status = "timed out and was interrupted"
+        else:
+            status = f"exit code {result['return_code']}"
+
+        if result["output_id"]:
+            # the notice in the output itself may be cut by bound_output
+            status += f", full output via read_output(output_id=\"{result['output_id']}\")"
+
+        section = f"[{i}/{len(commands)}] $ {command}\n({status})"
+
+        if result["output"].strip():
+            section += "\n" + bound_output(result["output"].rstrip("\n"))
+
+        sections.append(section)
+
+        if not result["success"]:
+            failed += 1
+
+            if stop_on_error:
+                if i < len(commands):
+                    sections.append(f"Stopped after command {i} failed, {len(commands) - i} not run")
+
+                break
+
+    summary = f"{ran} of {len(commands)} commands ran, {ran - failed} succeeded, {failed} failed"
+    return summary + "\n\n" + "\n\n".join(sections)
+
+
+@mcp.tool()
+async def read_output(output_id: str, offset: int = 0, limit: int = 200, pattern: Optional[str] = None) -> str:
+    """
+    Page or grep through the full output of an earlier command whose output was truncated
+
+    Args:
+        output_id: Id reported in the truncated output
+        offset: Number of lines to skip
+        limit: Maximum number of lines to return
+        pattern: Regular expression; only matching lines are returned
+
+    Returns:
+        Numbered output lines
+    """
+
+    path = spill_path(settings.terminal_spill_dir, output_id)
+
+    if path is None:
+        return f"No saved output with id {output_id}"
+
+    try:
+        regex = re.compile(pattern) if pattern else None
+
+    except re.error as e:
+        return f"Invalid pattern {pattern!r}: {e}"
+
+    limit = max(1, min(limit, 2000))
+    lines = await asyncio.to_thread(
+        lambda: [f"{n}: {line}" for n, line in read_spilled(path, max(offset, 0), limit, regex)]
+    )
+
+    if not lines:
+        return "No more lines" if regex is None else "No matching lines"
+
+    return '\n'.join(lines)
+
+def resolve_path(path: str) -> str:
+    # relative paths are relative to where the terminal is, not the server
+    path = os.path.expanduser(path)
+
+    if not os.path.isabs(path):
+        path = os.path.join(current_terminal.get().cwd() or os.getcwd(), path)
+
+    return os.path.normpath(path)
+
+@mcp.tool()
+async def start_job(command: str) -> str:
+    """
+    Start a long-running command (build, test suite, dev server) in the background and return immediately
+
+    Args:
+        command: Command line command to run
+
+    Returns:
+        Id of the job, for job_status, job_output and cancel_job
+    """
+
+    try:
+        terminal = current_terminal.get()
+        job = await job_manager.start(command, cwd=terminal.cwd() or os.getcwd(), owner=terminal.owner_key)
+
+    except (RuntimeError, OSError) as e:
+        return f"Failed to start job: {e}"
+
+    return f"Started job {job.job_id}: {command}"
+
+
+@mcp.tool()
+async def job_status(job_id: Optional[str] = None) -> str:
+    """
+    Status of a background job, or of all jobs
+
+    Args:
+        job_id: Id returned by start_job; all jobs when omitted
+
+    Returns:
+        Whether the job is running, its exit code and output size
+    """
+
+    owner = current_terminal.get().owner_key
+
+    if job_id is None:
+        return '\n'.join(job.status() for job in job_manager.owned(owner)) or "No jobs"
+
+    job = job_manager.get(job_id, owner)
+    return job.status() if job is not None else f"No job with id {job_id}"
+
+
+@mcp.tool()
+async def job_output(job_id: str, offset: Optional[int] = None, max_bytes: int = 32768) -> str:
+    """
+    Output of a background job, continuing from where the previous call stopped
+
+    Args:
+        job_id: Id returned by start_job
+        offset: Byte offset to read from instead (0 for the beginning)
+        max_bytes: Maximum number of bytes to return
+
+    Returns:
+        The new output and the offset to continue from
+    """
+
+    job = job_manager.get(job_id, current_terminal.get().owner_key)
+
+    if job is None:
+        return f"No job with id {job_id}"
+
+    data, start, end = await asyncio.to_thread(job_manager.read, job, offset, max(1, min(max_bytes, 262144)))
+
+    renderer = TerminalRenderer()
+    text = renderer.feed(data.decode('utf-8', errors='replace')) + renderer.flush()
+
+    return f"{job.status()}\nOutput bytes {start}-{end}:\n{text}"
+
+
+@mcp.tool()
+async def cancel_job(job_id: str) -> str:
+    """
+    Stop a background job and its child processes
+
+    Args:
+        job_id: Id returned by start_job
+
+    Returns:
+        Final status of the job
+    """
+
+    job = job_manager.get(job_id, current_terminal.get().owner_key)
+
+    if job is None:
+        return f"No job with id {job_id}"
+
+    await job_manager.cancel(job, grace=settings.terminal_kill_grace_seconds)
+    return job.status()
+
+
+@mcp.tool()
+async def read_attachment(digest: str, start_line: int = 1, end_line: Optional[int] = None) -> str:
+    """
+    Read the text of a file attached to the conversation, extracted on first use
+
+    Args:
+        digest: The sha256 digest listed with the attachment
+        start_line: First line to read (1-based)
+        end_line: Last line to read, inclusive (default: as much as fits)
+
+    Returns:
+        The requested lines of the attachment's text
+    """
+
+    attachment = attachment_store.get(digest)
+
+    if attachment is None:
+        return f"No attachment with digest {digest}"
+
+    try:
+        text_path = await asyncio.to_thread(attachment_store.text_path, attachment)
+
+    except AttachmentError as e:
+        return f"Failed to read {attachment.filename}: {e}"
+
+    part = await asyncio.to_thread(read_lines, text_path, start_line, end_line)
+    header = f"{attachment.filename}: lines {part.start}-{part.end}"
+
+    if part.truncated:
+        header += f", continue with start_line={part.end + 1}"
+
+    return f"{header}\n{part.text}"
+
+
 @mcp.tool()
 async def write_file(path: str, content: str, mode: str = "overwrite") -> str:
     """
-    Write content to a file
+    Write content to a file; large files can be written in parts with mode 'append'
     
     Args:
         path: Path to the file
@@ -214,52 +756,132 @@ async def write_file(path: str, content: str, mode: str = "overwrite") -> str:
     Returns:
         Operation result information
     """
-    
-    output = ''
-    
-    file_mode = "w" if mode.lower() == "overwrite" else "a"
-    directory = os.path.dirname(os.path.abspath(path))
-    
-    res = {
-        "success": os.path.exists(directory),
-    }
 
-    if not os.path.exists(directory):
-        quoted_dir = shlex.quote(directory)
-        res = await run_command(f"mkdir -p {quoted_dir}", safe=True)
-        output += res["output"]
+    append = mode.lower() == "append"
+    resolved = resolve_path(path)
+
+    if not isinstance(content, str):
+        content = json.dumps(content, indent=4, sort_keys=False, ensure_ascii=False)
 
     if content and not content.endswith('\n'):
         content += '\n'
 
-    quoted_content = shlex.quote(
-        content if isinstance(content, str) else json.dumps(content)
-    ).replace('$', r'\$').replace('\\', r'\\')
+    started_at = time.time()
+
+    try:
+        written = await asyncio.to_thread(write_atomic, resolved, content, append)
+
+    except OSError as e:
+        logger.error(f"Error writing file {resolved}: {e}")
+        return f"Failed to write {path}: {e}"
+
+    metrics.observe("write_file_bytes", written)
+    metrics.observe("write_file_seconds", time.time() - started_at)
+
+    # only a summary goes through the terminal, for whoever is watching
+    summary = f"{'appended' if append else 'wrote'} {written} bytes to {resolved}"
+    await announce(summary)
+
+    return f"Successfully {summary}"
+
+
+@mcp.tool()
+async def read_file(path: str, start_line: int = 1, end_line: Optional[int] = None, offset: Optional[int] = None, length: Optional[int] = None) -> str:
+    """
+    Read part of a file without going through the terminal
+
+    Args:
+        path: Path to the file
+        start_line: First line to read (1-based)
+        end_line: Last line to read, inclusive (default: as much as fits)
+        offset: Byte offset to read from, instead of lines
+        length: Number of bytes to read with offset (default 65536)
+
+    Returns:
+        The requested lines, prefixed with their line numbers, or the requested bytes
+    """
+
+    resolved = resolve_path(path)
+
+    try:
+        if offset is not None:
+            part = await asyncio.to_thread(read_bytes, resolved, offset, length or 65536)
+            header = f"{path}: bytes {part.start}-{part.end} of {part.size}"
+
+            if part.truncated:
+                header += f", continue with offset={part.end}"
+
+            return f"{header}\n{part.text}"
+
+        if await asyncio.to_thread(is_binary, resolved):
+            return f"{path} is a binary file, read it with offset and length"
+
+        part = await asyncio.to_thread(read_lines, resolved, start_line, end_line)
 
-    quoted_path = shlex.quote(path)
+    except (FileNotFoundError, IsADirectoryError, PermissionError) as e:
+        return f"Failed to read {path}: {e}"
 
-    if res["success"]:
-        res = await run_command(
-            f"echo {quoted_content} > {quoted_path}" 
-            if file_mode == "w" else 
-            f"echo {quoted_content} >> {quoted_path}",
-            safe=True,
-            fast=True
-        )
+    metrics.observe("read_file_bytes", len(part.text))
 
-        output += "\n" + res["output"]
+    if part.end < part.start:
+        return f"{path}: no lines from line {part.start} ({part.size} bytes)"
 
-    with open(path, file_mode, encoding='utf-8') as f:
-        if isinstance(content, str):
-            f.write(content)
+    header = f"{path}: lines {part.start}-{part.end} ({part.size} bytes)"
+
+    if part.truncated:
+        header += f", continue with start_line={part.end + 1}"
+
+    numbered = '\n'.join(
+        f"{n:>6}\t{line}"
+        for n, line in enumerate(part.text.removesuffix('\n').split('\n'), start=part.start)
+    )
+
+    return f"{header}\n{numbered}"
+
+
+@mcp.tool()
+async def patch_file(path: str, search: Optional[str] = None, replace: Optional[str] = None, diff: Optional[str] = None) -> str:
+    """
+    Edit a file in place, either replacing one exact occurrence of `search` with `replace`, or applying a unified diff
+
+    Args:
+        path: Path to the file
+        search: Exact text to replace; must occur exactly once
+        replace: Replacement text
+        diff: Unified diff to apply, instead of search and replace
+
+    Returns:
+        Operation result information
+    """
+
+    resolved = resolve_path(path)
+
+    def patch() -> str:
+        with open(resolved, encoding='utf-8', newline='') as f:
+            content = f.read()
+
+        if diff is not None:
+            patched, added, removed = apply_unified_diff(content, diff)
+            summary = f"+{added} -{removed} lines"
+        elif search is not None:
+            patched = search_replace(content, search, replace or '')
+            summary = "1 occurrence replaced"
         else:
-            try:
-                import json
-                json.dump(content, f, indent=4, sort_keys=False, ensure_ascii=False)
-            except Exception as e:
-                pass
+            raise PatchError("either diff, or search and replace, is required")
 
-    return output
+        write_atomic(resolved, patched)
+        return summary
+
+    try:
+        summary = await asyncio.to_thread(patch)
+
+    except (PatchError, OSError, UnicodeDecodeError) as e:
+        metrics.inc("patch_file_failures")
+        return f"Failed to patch {path}: {e}"
+
+    metrics.inc("patch_file_applied")
+    await announce(f"patched {resolved} ({summary})")
+    return f"Successfully patched {path}: {summary}"
 
 
 @mcp.tool()
@@ -273,33 +895,10 @@ async def internet_search(query: str) -> str:
     Returns: Related information
     """
 
-    body = {
-        "url": "https://api.tavily.com/search",
-        "headers": {
-            "Content-Type": "application/json",
-        },
-        "body": {
-            "query": query,
-            "max_results": 5,
-            "include_image_descriptions": True,
-            "include_images": True,
-            "search_depth": "advanced",
-            "topic": "general"
-        },
-        "method": "POST"
-    }
-
-    data = {
-        'messages': [
-            {
-                'role': 'user',
-                'content': json.dumps(body)
-            }
-        ]
-    }
-
-    data_str = json.dumps(data, indent=2)
-    data_str = shlex.quote(data_str).replace('\\', r'\\')
-    command = f"curl -X POST \\$ETERNALAI_MCP_PROXY_URL -H 'Content-Type: application/json' -d {data_str}"
-    res = await run_command(command, safe=True, fast=True)
-    return res["output"]
\ No newline at end of file
+    try:
+        return await search_client.search(query)
+
+    except (httpx.HTTPError, RuntimeError) as e:
+        logger.error(f"Search for {query!r} failed: {e}")
+        metrics.inc("search_failures")
+        return f"Search failed: {e}"
@@ -0,0 +1,118 @@
+"""
+Chunks/s per core of the /prompt upstream stream parsing.
+
+legacy: text lines + json.loads + ChatCompletionStreamResponse.model_validate
+        per chunk (the previous create_streaming_response path)
+bytes:  SSEDecoder over raw byte buffers + json.loads into plain dicts
+
+Run from the repository root: python -m benchmarks.sse_parser [n_chunks]
+"""
+import codecs
+import json
+import random
+import sys
+import time
+
+from agent.oai_models import ChatCompletionStreamResponse
+from agent.oai_streaming import SSEDecoder
+
+
+def make_stream(n_chunks: int, seed: int = 0) -> list[bytes]:
+    rng = random.Random(seed)
+    words = ["the", "terminal", "build", "passed", "ok", "npm", "install", "λ", "déjà", "vu"]
+    events = []
+
+    for i in range(n_chunks):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "bench-model",
+            "choices": [{
+                "index": 0,
+                "delta": {"content": " " + rng.choice(words)},
+                "finish_reason": None
+            }]
+        }
+        events.append(f"data: {json.dumps(chunk)}\n\n")
+
+        if i % 50 == 0:
+            events.append(": ping\n\n")
+
+    events.append("data: [DONE]\n\n")
+    body = "".join(events).encode("utf-8")
+
+    # cut the body at arbitrary points, as the network does
+    pieces, i = [], 0
+
+    while i < len(body):
+        size = rng.randint(64, 4096)
+        pieces.append(body[i:i + size])
+        i += size
+
+    return pieces
+
+
+def parse_legacy(pieces: list[bytes]) -> int:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending, n = "", 0
+
+    for piece in pieces:
+        pending += decoder.decode(piece)
+        *lines, pending = pending.split("\n")
+
+        for line in lines:
+            while line.startswith("data: "):
+                line = line[6:].strip()
+
+            if line == "" or line.startswith(": ping"):
+                continue
+
+            if line == "[DONE]":
+                return n
+
+            resp_json = json.loads(line)
+
+            if resp_json.get("object", "") == "chat.completion.chunk":
+                ChatCompletionStreamResponse.model_validate(resp_json)
+                n += 1
+
+    return n
+
+
+def parse_bytes(pieces: list[bytes]) -> int:
+    decoder, n = SSEDecoder(), 0
+
+    for piece in pieces:
+        for line in decoder.feed(piece):
+            if line == b"[DONE]":
+                return n
+
+            resp_json = json.loads(line)
+
+            if resp_json.get("object", "") == "chat.completion.chunk":
+                n += 1
+
+    return n
+
+
+def bench(name: str, fn, pieces: list[bytes], repeat: int = 5) -> float:
+    best = float("inf")
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        n = fn(pieces)
+        best = min(best, time.perf_counter() - started)
+
+    rate = n / best
+    print(f"{name:>8}: {n} chunks in {best * 1000:.1f} ms -> {rate:,.0f} chunks/s")
+    return rate
+
+
+if __name__ == "__main__":
+    n_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    pieces = make_stream(n_chunks)
+
+    legacy = bench("legacy", parse_legacy, pieces)
+    fast = bench("bytes", parse_bytes, pieces)
+    print(f"speedup: {fast / legacy:.1f}x")
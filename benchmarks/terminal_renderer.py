@@ -0,0 +1,133 @@
+"""
+Size of command output handed to the LLM, before and after rendering.
+
+legacy:   remove_console_color + CRLF normalisation (the previous cleanup)
+rendered: TerminalRenderer, which applies carriage returns, cursor
+          movement and line erasure and keeps only the final screen lines
+
+The corpus is synthetic but shaped after real logs: pip/curl style `\r`
+progress bars, an npm spinner, cargo's multi-line status redrawn with
+cursor-up, and a plain compiler log that should not shrink at all.
+
+Run from the repository root: python -m benchmarks.terminal_renderer [scale]
+"""
+import random
+import sys
+import time
+
+from agent.xterm_toolcalls import TerminalRenderer, remove_console_color
+
+
+def pip_install(rng: random.Random, scale: int) -> str:
+    out = []
+
+    for pkg in range(10 * scale):
+        name = f"package_{pkg}-1.{rng.randint(0, 9)}.0"
+        out.append(f"Collecting {name}\r\n  Downloading {name}.whl (2.1 MB)\r\n")
+
+        for step in range(0, 101, 2):
+            bar = "\x1b[32m" + "━" * (step // 4) + "\x1b[0m" + "━" * (25 - step // 4)
+            out.append(f"\r     {bar} {step * 21 // 1000}.{step % 10}/2.1 MB \x1b[31m{rng.randint(1, 9)}.0 MB/s\x1b[0m eta 0:00:0{rng.randint(0, 9)}")
+
+        out.append("\r\n")
+
+    out.append("Successfully installed " + " ".join(f"package_{i}" for i in range(10 * scale)) + "\r\n")
+    return "".join(out)
+
+
+def curl_download(rng: random.Random, scale: int) -> str:
+    out = ["  % Total    % Received % Xferd  Average Speed   Time    Time     Time  Current\r\n"]
+
+    for step in range(0, 101):
+        for _ in range(scale):
+            out.append(f"\r{step:3d}  100M  {step:3d}  {step}M    0     0  {rng.randint(10, 99)}.1M      0  0:00:05  0:00:0{step // 20}  0:00:0{5 - step // 20} {rng.randint(10, 99)}.3M")
+
+    out.append("\r\n")
+    return "".join(out)
+
+
+def npm_spinner(rng: random.Random, scale: int) -> str:
+    out = []
+
+    for i in range(200 * scale):
+        frame = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"[i % 10]
+        out.append(f"\x1b[1G\x1b[0K{frame} reify:lodash: timing reifyNode:node_modules/pkg{i} Completed in {rng.randint(1, 900)}ms")
+
+    out.append("\x1b[1G\x1b[0K\r\nadded 812 packages in 14s\r\n")
+    return "".join(out)
+
+
+def cargo_build(rng: random.Random, scale: int) -> str:
+    out = []
+
+    for i in range(60 * scale):
+        out.append(f"   \x1b[1m\x1b[32mCompiling\x1b[0m crate_{i} v0.{rng.randint(1, 9)}.0\r\n")
+        # the status bar is redrawn below the log, then erased before the next line
+        out.append(f"\x1b[1m\x1b[36m    Building\x1b[0m [=====>   ] {i}/{60 * scale}: crate_{i}, crate_{i + 1}\r\n")
+        out.append("\x1b[1A\x1b[2K")
+
+    out.append("    \x1b[1m\x1b[32mFinished\x1b[0m dev [unoptimized + debuginfo] target(s) in 42.0s\r\n")
+    return "".join(out)
+
+
+def compiler_log(rng: random.Random, scale: int) -> str:
+    return "".join(
+        f"src/module_{i}.c:{rng.randint(1, 999)}:{rng.randint(1, 80)}: warning: unused variable 'x{i}' [-Wunused-variable]\r\n"
+        for i in range(200 * scale)
+    )
+
+
+CORPUS = {
+    "pip": pip_install,
+    "curl": curl_download,
+    "npm": npm_spinner,
+    "cargo": cargo_build,
+    "gcc": compiler_log,
+}
+
+
+def legacy(text: str) -> str:
+    return remove_console_color(text).replace("\r\n", "\n")
+
+
+def rendered(text: str, chunk_size: int = 4096) -> str:
+    renderer, out = TerminalRenderer(), []
+
+    for i in range(0, len(text), chunk_size):
+        out.append(renderer.feed(text[i:i + chunk_size]))
+
+    out.append(renderer.flush())
+    return "".join(out)
+
+
+def bench(fn, text: str, repeat: int = 3) -> tuple[str, float]:
+    best, out = float("inf"), ""
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn(text)
+        best = min(best, time.perf_counter() - started)
+
+    return out, best
+
+
+if __name__ == "__main__":
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    rng = random.Random(0)
+    total_legacy = total_rendered = 0
+
+    print(f"{'log':>6} {'raw':>10} {'legacy':>10} {'rendered':>10} {'reduction':>10} {'MB/s':>8}")
+
+    for name, make in CORPUS.items():
+        text = make(rng, scale)
+        old, _ = bench(legacy, text)
+        new, seconds = bench(rendered, text)
+        total_legacy += len(old)
+        total_rendered += len(new)
+
+        print(
+            f"{name:>6} {len(text):>10,} {len(old):>10,} {len(new):>10,} "
+            f"{len(old) / max(len(new), 1):>9.1f}x {len(text) / seconds / 1e6:>8.1f}"
+        )
+
+    print(f"total: {total_legacy:,} -> {total_rendered:,} chars, {total_legacy / total_rendered:.1f}x smaller")
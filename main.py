@@ -4,11 +4,14 @@ logger = logging.getLogger(__name__)
 
 import os
 import sys
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from agent.anthropic_proxy import app as anthropic_proxy_app
 import asyncio
 from agent.apis import router as apis_app
 from agent.configs import settings
+from agent.terminal import terminal_pool
+from agent.search import search_client
+from agent.jobs import job_manager
 import shlex
 import uvicorn
 
@@ -36,6 +39,9 @@ async def lifespan(app: FastAPI):
 
     processes: list[asyncio.subprocess.Process] = []
 
+    logger.info(f"Starting terminal pool of {settings.terminal_pool_size} sessions")
+    await terminal_pool.start()
+
     for call in calls:
         logger.info(f"Starting process: {call}")
         process = await asyncio.create_subprocess_shell(
@@ -68,21 +74,27 @@ async def lifespan(app: FastAPI):
                 process.kill()
                 logger.warning(f"Process {process.pid} killed after 10 seconds")
 
+        await job_manager.stop()
+        await terminal_pool.stop()
+        await search_client.aclose()
         logger.info("Shutdown complete")
 
+class RequestLogMiddleware:
+    # plain ASGI: @app.middleware("http") wraps the app in BaseHTTPMiddleware,
+    # which hides client disconnects from Request.is_disconnected()
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            logger.debug(f"Request: {scope['method']} {scope['path']}")
+
+        await self.app(scope, receive, send)
+
 app = FastAPI(lifespan=lifespan)
 app.include_router(anthropic_proxy_app)
 app.include_router(apis_app)
-
-
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    method = request.method
-    path = request.url.path
-    logger.debug(f"Request: {method} {path}")
-    response = await call_next(request)
-    
-    return response
+app.add_middleware(RequestLogMiddleware)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=settings.port)
\ No newline at end of file
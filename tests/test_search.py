@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from agent.configs import settings
+from agent.search import SearchClient
+
+RESULTS = {
+    "answer": "Paris",
+    "results": [
+        {"title": "France", "url": "https://example.com/france", "content": "The capital   of France is Paris."}
+    ],
+    "images": ["https://example.com/paris.jpg"]
+}
+
+class StubProxy:
+    """Stands in for the MCP proxy, counting the requests it serves."""
+
+    def __init__(self, payload, delay: float = 0.0):
+        self.payload = payload
+        self.delay = delay
+        self.queries: list[str] = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(json.loads(request.content)["messages"][0]["content"])
+        self.queries.append(body["body"]["query"])
+
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        return httpx.Response(200, json=self.payload)
+
+@pytest.fixture(autouse=True)
+def proxy_url(monkeypatch):
+    monkeypatch.setattr(settings, "search_proxy_url", "http://proxy.test/search")
+
+def make_client(proxy: StubProxy) -> SearchClient:
+    client = SearchClient(ttl=60, max_entries=8, timeout=5)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(proxy))
+    return client
+
+def test_repeated_query_is_served_from_cache():
+    proxy = StubProxy(RESULTS)
+
+    async def run():
+        client = make_client(proxy)
+        first = await client.search("Capital of France")
+        second = await client.search("  capital of   FRANCE ")
+        await client.aclose()
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first == second
+    assert proxy.queries == ["Capital of France"]
+
+def test_concurrent_identical_queries_share_one_request():
+    proxy = StubProxy(RESULTS, delay=0.05)
+
+    async def run():
+        client = make_client(proxy)
+        results = await asyncio.gather(*[client.search("capital of france") for _ in range(5)])
+        await client.aclose()
+        return results
+
+    results = asyncio.run(run())
+
+    assert len(set(results)) == 1
+    assert len(proxy.queries) == 1
+
+def test_nested_json_string_payload_is_unwrapped():
+    wrapped = {"choices": [{"message": {"content": json.dumps({"data": RESULTS})}}]}
+    proxy = StubProxy(wrapped)
+
+    async def run():
+        client = make_client(proxy)
+        result = await client.search("capital of france")
+        await client.aclose()
+        return result
+
+    result = asyncio.run(run())
+
+    assert result.startswith("Answer: Paris")
+    assert "1. France\n   https://example.com/france\n   The capital of France is Paris." in result
+    assert "- image: https://example.com/paris.jpg" in result